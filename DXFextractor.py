@@ -1,12 +1,20 @@
+import math
 import ezdxf
 import numpy as np
 from vector import Vector
+from dxf_stream import read_entities
 # https://www.ae.msstate.edu/vlsm/truss/statically_det_indet_trusses/statically_det_indet_trusses.htm
 
 # https://pypi.org/project/ezdxf/
 
 
+SPARSE_THRESHOLD = 400  # equations, solve_truss hands anything bigger to the sparse solver in TrussModel
+WELD_TOLERANCE = 1e-5  # m, endpoints closer than this are the same node (a few steps of round_list)
+
+
 class Member:
+    __slots__ = ('start', 'end', '_length')
+
     def __init__(self, line):
         if type(line) == ezdxf.entities.line.Line:  # dxf line
             # dxf_line is a different type of object with x, y, z
@@ -15,6 +23,14 @@ class Member:
         else:  # two tuples or whatever
             self.start = Vector(*round_list(line[0][:2]))  # kinda jank
             self.end = Vector(*round_list(line[1][:2]))
+        self._length = None
+
+    @property
+    def length(self):
+        """ length of the member, worked out once since start and end don't change """
+        if self._length is None:
+            self._length = (self.end - self.start).norm()
+        return self._length
 
     def __str__(self):
         return f"{self.start}  ->  {self.end}"
@@ -27,25 +43,130 @@ def round_list(input, degree=6):
     return output
 
 
-def extract_from_file(file_name):
+def extract_from_file(file_name, tolerance=WELD_TOLERANCE, streaming=True, verbose=False):
     """ Gets the line data from the dxf file
     converts dxf lines to Members
 
     :param file_name: file name of the dxf
+    :param tolerance: endpoints (and anchors) closer than this are welded into one node, None to skip
+    :param streaming: read just the LINE and POINT entities with dxf_stream instead of loading the whole
+                      document with ezdxf, falls back to ezdxf if the file can't be streamed
+    :param verbose: print the endpoints that were welded and the dangling nodes
     :return: list of Members, list of two Vectors
     """
-    doc = ezdxf.readfile(file_name)
-    model_space = doc.modelspace()
-    raw_lines = list(model_space.query('LINE[linetype=="Continuous"]'))
-    roots = [Vector(*round_list(list(node.dxf.location)[:2])) for node in model_space.query('POINT')]
+    entities = read_entities(file_name) if streaming else None
+    if entities is not None:
+        raw_lines, raw_points = entities
+        lines = [Member(l) for l in raw_lines.tolist()]
+        roots = [Vector(*round_list(point)) for point in raw_points.tolist()]
+    else:
+        doc = ezdxf.readfile(file_name)
+        model_space = doc.modelspace()
+        raw_lines = list(model_space.query('LINE[linetype=="Continuous"]'))
+        roots = [Vector(*round_list(list(node.dxf.location)[:2])) for node in model_space.query('POINT')]
+        lines = [Member(l) for l in raw_lines]  # converts to a member object
+
+    if tolerance is not None:
+        roots, merged, dangling = weld_nodes(lines, tolerance, roots)
+        if verbose and merged:
+            print("welded:", ", ".join("/".join(str(p) for p in cluster) for cluster in merged))
+        if verbose and dangling:
+            print("dangling:", ", ".join(str(p) for p in dangling))
+    return lines, roots
+
+
+def save_file(lines, A, B, file_name):
+    """ Writes the members and the two anchors to a dxf file, the inverse of extract_from_file
+
+    :param lines: list of Members
+    :param A: Vector, anchor point
+    :param B: Vector, anchor point
+    :param file_name: file name of the dxf
+    :return: None
+    """
+    doc = ezdxf.new('R2010')
+    msp = doc.modelspace()
+    for line in lines:
+        msp.add_line(tuple(line.start), tuple(line.end), dxfattribs={"linetype": "Continuous"})
+
+    for anchor in (A, B):
+        msp.add_point(tuple(anchor))
+
+    doc.saveas(file_name)
+
+
+def weld_points(points, tolerance):
+    """ Groups points that are within tolerance of each other
+    uniform grid spatial hash with cells the size of the tolerance, so only the 3x3 cells around a point
+    need checking and the whole thing is O(n). The first point of a group is kept as its position
+
+    :param points: list of Vectors (or anything indexable with x, y)
+    :param tolerance: largest distance between two points of the same group
+    :return: list of group index per point, list of group positions
+    """
+    grid = {}  # (cell x, cell y): list of group indices
+    welded = []
+    labels = []
+    for point in points:
+        x, y = point[0], point[1]
+        cell_x, cell_y = math.floor(x / tolerance), math.floor(y / tolerance)
+        label = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in grid.get((cell_x + dx, cell_y + dy), ()):
+                    if math.hypot(welded[other][0] - x, welded[other][1] - y) <= tolerance:
+                        label = other
+                        break
+                if label is not None:
+                    break
+            if label is not None:
+                break
+        if label is None:
+            label = len(welded)
+            welded.append(point)
+            grid.setdefault((cell_x, cell_y), []).append(label)
+        labels.append(label)
+    return labels, welded
+
+
+def weld_nodes(lines, tolerance=WELD_TOLERANCE, anchors=()):
+    """ Snaps member endpoints that are within tolerance of each other onto one node
+    CAD endpoints that should meet can be a hair apart and land either side of a round_list step,
+    which would make two nodes and a bad system. Members are changed in place
+
+    :param lines: list of Members
+    :param tolerance: largest distance between endpoints of the same node
+    :param anchors: Vectors to snap onto the welded nodes as well (A and B)
+    :return: list of snapped anchors, list of merged clusters (each a list of the distinct positions that
+             became one node), list of dangling nodes (only one member ends there)
+    """
+    points = [line.start for line in lines] + [line.end for line in lines] + list(anchors)
+    labels, welded = weld_points(points, tolerance)
+
+    clusters = {}
+    for label, point in zip(labels, points):
+        cluster = clusters.setdefault(label, [])
+        if point not in cluster:
+            cluster.append(point)
+    merged = [cluster for cluster in clusters.values() if len(cluster) > 1]
 
-    return [Member(l) for l in raw_lines], roots  # converts to a member object
+    members_at = [0] * len(welded)
+    for i, line in enumerate(lines):
+        line.start = welded[labels[i]]
+        line.end = welded[labels[len(lines) + i]]
+        line._length = None
+        members_at[labels[i]] += 1
+        members_at[labels[len(lines) + i]] += 1
+    dangling = [welded[label] for label, count in enumerate(members_at) if count == 1]
+
+    return [welded[label] for label in labels[2*len(lines):]], merged, dangling
 
 
 def get_nodes_from_lines(lines):
     """ Gets the nodes that connect the lines
     does this by collecting all of the endpoints from a line in a dictionary
     key is the node position, value is an array of indicies of the members that meet at that point
+    endpoints have to match exactly, weld_nodes (or extract_from_file) snaps near misses together first
 
     :param lines: list of Members
     :return: dictionary of nodes key: Vector, value: list indices of lines relating to lines
@@ -89,6 +210,11 @@ def solve_truss(lines, A, B):
         # system is indeterminate
         return None
 
+    if 2*len(nodes) > SPARSE_THRESHOLD:
+        # too big for a dense matrix, the compiled model assembles and solves it sparse
+        from truss_model import TrussModel
+        return TrussModel(lines, A, B, list(nodes.keys())).solve()
+
     # 2 times for x and y, + 3 for the 3 reaction forces
     coefficient_matrix = np.zeros((2*len(nodes), len(lines) + 3))
     constant_matrix = np.zeros((2*len(nodes)))
@@ -1,6 +1,5 @@
 import pygame
 import pygame.freetype
-import os
 import math
 import tkinter
 import tkinter.filedialog
@@ -8,30 +7,15 @@ import ezdxf
 import numpy as np
 from vector import Vector
 from DXFextractor import *
-
-
-def draw_truss_body(lines, forces, mouse_pos):
-    """ draws the lines to the screen after transforming the coordinates to match screen
-
-    :param lines: list of Member objects
-    :return: None
-    """
-    color = (100, 100, 100)
-    for member, force in zip(lines, forces):
-        num_parallel = calculate_parallel(force)
-
-        if num_parallel != 2:  # when equal to 0, 1, 3 (zero force member was disappearing)
-            pygame.draw.line(screen, color, transform(member.start), transform(member.end), 1)
-        if num_parallel == 2 or num_parallel == 3:
-            offset = 0.03*(member.end - member.start).rotate(90).normalize()
-            pygame.draw.line(screen, color, transform(member.start + offset), transform(member.end + offset), 1)
-            pygame.draw.line(screen, color, transform(member.start - offset), transform(member.end - offset), 1)
-
-        start_color = (100, 0, 0) if (transform(member.start) - mouse_pos).norm() < r else (0, 0, 0)
-        end_color = (100, 0, 0) if (transform(member.end) - mouse_pos).norm() < r else (0, 0, 0)
-
-        pygame.draw.circle(screen, start_color, round(transform(member.start)), 5)
-        pygame.draw.circle(screen, end_color, round(transform(member.end)), 5)
+from truss_model import TrussModel, node_array
+from incremental_solver import IncrementalSolver
+from solution_cache import SolutionCache
+from truss_cache import load_truss
+from influence import influence_lines
+from constraints import Constraints, describe
+from symmetry import SymmetricDesign
+from file_watch import FileWatcher, LatestWorker
+from truss_renderer import TrussRenderer
 
 
 def calculate_parallel(force):
@@ -40,18 +24,41 @@ def calculate_parallel(force):
     return max(1, min(math.ceil(force / max_force), 3))
 
 
-def write_forces(lines, forces):
-    for i, line in enumerate(lines):
-        render_str = f"{round(forces[i], 2)} kN {'(T)' if forces[i] < 0 else '(C)'}"
-        textsurface, _ = font.render(render_str, (0, 0, 0))
-        midpoint = line.start + 0.5*(line.end - line.start)
-        screen.blit(textsurface, round(transform((midpoint)) - Vector(40, 10)))
+def draw_influence_line(coordinates, positions, forces, mouse_pos):
+    """ draws the influence line of the member closest to the mouse along the deck
+    compression is drawn above the deck and tension below
+
+    :param coordinates: (n_nodes, 2) array of node positions, same order as the model
+    :param positions: x positions of the unit load
+    :param forces: (positions, n_members + 3) array from influence_lines
+    :param mouse_pos: Vector
+    :return: None
+    """
+    color = (0, 0, 160)
+    midpoints = (coordinates[model.start] + coordinates[model.end]) / 2
+    mouse = inverse_transform(mouse_pos)
+    member = int(np.argmin(np.hypot(midpoints[:, 0] - mouse[0], midpoints[:, 1] - mouse[1])))
+
+    pygame.draw.line(screen, color, transform(Vector(*coordinates[model.start[member]])),
+                     transform(Vector(*coordinates[model.end[member]])), 3)
+    pygame.draw.line(screen, (160, 160, 220), transform(Vector(positions[0], 0)), transform(Vector(positions[-1], 0)), 1)
+    points = [tuple(transform(Vector(x, influence_scale * force))) for x, force in zip(positions, forces[:, member])]
+    pygame.draw.lines(screen, color, False, points, 2)
+
+    extreme = np.argmax(np.abs(forces[:, member]))
+    text, _ = font.render(f"{round(forces[extreme, member], 3)} kN per kN at x = {round(positions[extreme], 2)}", color)
+    screen.blit(text, tuple(transform(Vector(positions[extreme], influence_scale * forces[extreme, member])) + Vector(5, -15)))
 
 
 def transform(vector):
     return scale*vector.matrix_mult([[1, 0], [0, -1]]) + Vector(x_offset, y_offset)
 
 
+def transform_array(coordinates):
+    """ transform for an (n, 2) array of points """
+    return np.column_stack((scale*coordinates[:, 0] + x_offset, -scale*coordinates[:, 1] + y_offset))
+
+
 def inverse_transform(vector):
     return (1/scale)*(vector - Vector(x_offset, y_offset)).matrix_mult([[1, 0], [0, -1]])
 
@@ -61,28 +68,27 @@ def calculate_cost(lines, forces):
     member = 15
     cost = gusset * len(get_nodes_from_lines(lines))
     for line, force in zip(lines, forces):
-        cost += member * (line.end - line.start).norm() * calculate_parallel(force)
+        cost += member * line.length * calculate_parallel(force)
     return cost
 
 
 def is_valid(lines, forces, A, B):
-    floor_nodes = get_floor_nodes(get_nodes_from_lines(lines))
-    if B-A != Vector(12, 0):
-        return "Supports A & B invalid"
+    constraints, coordinates = Constraints.from_lines(lines, A, B, min_force=min_force, max_force=max_force)
+    return describe(constraints.violations(coordinates, forces))  # every rule broken, with the members
 
-    for i in range(len(floor_nodes) - 1):
-        if (Vector(*floor_nodes[i]) - Vector(*floor_nodes[i+1])).norm() > 3.5:
-            return "Floor beams too long"
 
-    for line in lines:
-        if (line.end - line.start).norm() < 1:
-            return "Members too short"
+def status_text(lines, forces, A, B):
+    return [f"Cost: ${round(calculate_cost(lines, forces), 2)}", f"Validity: {is_valid(lines, forces[:-3], A, B)}"]
+
 
-    for force in forces:
-        if force < min_force * calculate_parallel(force) or force > max_force * calculate_parallel(force):
-            return "Force exceeded"
+def drag_node(node_keys, index, position):
+    """ moves a node through the symmetry layer, its mirror image (if it has one) follows
+    and a node on the midline only moves up and down
 
-    return "Design Valid"
+    :return: new list of node Vectors
+    """
+    coordinates = design.move(node_array(node_keys), index, tuple(position))
+    return [Vector(*node) for node in coordinates.tolist()]
 
 
 def get_adjacency_matrix(lines, node_positons):  # this truss is bassically just a graph use DSA of graph
@@ -113,6 +119,20 @@ def reconstruct_lines(nodes, adjacency_matrix):
     return lines
 
 
+def load_design(file_name):
+    """ everything the main loop needs for a drawing, runs on the loader thread so parsing and
+    factorizing a big drawing doesn't hold up the frames
+
+    :return: lines, A, B, node_keys, adjacency_matrix, forces, model, solver, design
+    """
+    lines, (A, B), node_keys, adjacency_matrix = load_truss(file_name)  # one array read once the drawing is cached
+    forces = np.round(engine(lines, A, B).solve(), decimals=4)
+    model = engine(reconstruct_lines(node_keys, adjacency_matrix), A, B, node_keys)  # member order matches reconstruct_lines
+    solver = IncrementalSolver(model) if engine is TrussModel else model  # dragging a node only re-solves the members around it
+    design = SymmetricDesign.from_model(model)  # mirror pairs about the midline, drag_node keeps them in step
+    return lines, A, B, node_keys, adjacency_matrix, forces, model, solver, design
+
+
 def save_file(lines, A, B):
     top = tkinter.Tk()
     top.withdraw()
@@ -144,24 +164,26 @@ r = 5  # radius to snap to node
 scale = 100
 x_offset = 100
 y_offset = 600
+influence_scale = 1  # m of screen per kN of member force for a 1 kN load
 
 np.set_printoptions(linewidth=200)
 file_name = 'O.DXF'
 # file_name = '1026.DXF'
-lines, (A, B) = extract_from_file(file_name)
-moddate = os.stat(file_name)[8]
-forces = np.round(solve_truss(lines, A, B), decimals=4)
-member_forces = forces[:-3]
-Ax, Ay, By = forces[-3:]
+engine = TrussModel  # stiffness.StiffnessModel also solves indeterminate (redundant member) designs
 min_force = -9  # tension
 max_force = 6  # compression
-
-nodes = get_nodes_from_lines(lines)  # value indices are line indices NOT node indices
-node_keys = list(nodes.keys())
-node_keys.sort(key=lambda e: e[0])
-adjacency_matrix = get_adjacency_matrix(lines, node_keys)  # adjacency matrix will not change for a particular topology
+lines, A, B, node_keys, adjacency_matrix, forces, model, solver, design = load_design(file_name)
+member_forces = forces[:-3]
+Ax, Ay, By = forces[-3:]
+cache = SolutionCache(maxsize=1000)  # holding the mouse still keeps asking for the same layout
+loader = LatestWorker(load_design)  # reloads happen off the render thread
+watcher = FileWatcher(file_name, loader.submit)  # waits for a save to finish, then hands the file to loader
+renderer = TrussRenderer(screen, font, transform_array, min_force, max_force, scale)  # only redraws what changed
+renderer.set_truss(lines, member_forces, status_text(lines, forces, A, B))
 
 current_node_index = None
+show_influence = False  # toggled with i
+influence = None  # positions, forces, recalculated when the geometry changes
 
 running = True
 while running:
@@ -178,23 +200,19 @@ while running:
             if event.key == pygame.K_s and pygame.key.get_mods() & pygame.KMOD_CTRL:
                 # save the current truss
                 save_file(lines, A, B)
+            if event.key == pygame.K_i:
+                show_influence = not show_influence
 
         if event.type == pygame.MOUSEBUTTONUP:
             current_node_index = None
 
     if pygame.mouse.get_pressed()[0] and current_node_index is not None:
+        previous = node_keys[:]
         if node_keys[current_node_index][1] == 0:
             if node_keys[current_node_index][0] != 0 and node_keys[current_node_index][0] != 12:  # at equality this is the end of the road, do not touch
                 # floor node can only be manipulated in x
                 new = inverse_transform(Vector(*pygame.mouse.get_pos())).matrix_mult([[1, 0], [0, 0]])
-                
-                # stay symmetrical if it already is
-                for i in range(0, len(node_keys)):
-                    node = node_keys[i]
-                    if i != current_node_index and node[1] == 0 and node[0] == 12 - node_keys[current_node_index][0]:
-                        node_keys[i] = Vector(12-new[0], 0)
-
-                node_keys[current_node_index] = new
+                node_keys = drag_node(node_keys, current_node_index, new)  # stays symmetrical if it already is
 
         elif node_keys[current_node_index] == A:
             A = inverse_transform(Vector(*pygame.mouse.get_pos())).matrix_mult([[0, 0], [0, 1]])
@@ -213,47 +231,46 @@ while running:
         else:
             # not a floor node, can be manipulated in x and y
             new = inverse_transform(Vector(*pygame.mouse.get_pos()))
-
-            # stay symmetrical if it already is
-            for i in range(0, len(node_keys)):
-                node = node_keys[i]
-                if i != current_node_index and node[1] == node_keys[current_node_index][1] and node[0] == 12 - node_keys[current_node_index][0]:
-                    node_keys[i] = Vector(12-new[0], new[1])
-
-            node_keys[current_node_index] = new
-
-        lines = reconstruct_lines(node_keys, adjacency_matrix)
-        forces = np.round(solve_truss(lines, A, B), decimals=4)
-        member_forces = forces[:-3]
-        Ax, Ay, By = forces[-3:]
-
-    try:
-        if os.stat(file_name)[8] != moddate:
-            moddate = os.stat(file_name)[8]
-            lines, (A, B) = extract_from_file(file_name)
-            forces = np.round(solve_truss(lines, A, B), decimals=4)
+            node_keys = drag_node(node_keys, current_node_index, new)  # stays symmetrical if it already is
+
+        if node_keys != previous:  # holding a node still doesn't need anything solved or drawn
+            lines = reconstruct_lines(node_keys, adjacency_matrix)
+            node_coordinates = node_array(node_keys)
+            forces = cache.get(model, node_coordinates)
+            if forces is None:
+                forces = np.round(solver.solve(node_coordinates), decimals=4)
+                cache.put(model, node_coordinates, forces)
             member_forces = forces[:-3]
             Ax, Ay, By = forces[-3:]
-
-            nodes = get_nodes_from_lines(lines)  # value indices are line indices NOT node indices
-            node_keys = list(nodes.keys())
-            node_keys.sort(key=lambda e: e[0])
-            adjacency_matrix = get_adjacency_matrix(lines,
-                                                    node_keys)  # adjacency matrix will not change for a particular topology
-    except FileNotFoundError:
-        pass  # may have caught it between saves
-
-    screen.fill((240, 240, 240))
-    draw_truss_body(lines, member_forces, Vector(*pygame.mouse.get_pos()))
-    write_forces(lines, member_forces)
-
-    cost, _ = font.render(f"Cost: ${round(calculate_cost(lines, forces), 2)}", (0, 0, 0))
-    valid, _ = font.render(f"Validity: {is_valid(lines, member_forces, A, B)}", (0, 0, 0))
-    screen.blit(cost, (10, 10))
-    screen.blit(valid, (10, 30))
-
-    pygame.display.flip()
-
+            influence = None
+            renderer.set_truss(lines, member_forces, status_text(lines, forces, A, B))
+
+    reloaded = loader.poll()
+    if reloaded is not None:
+        design_state, error = reloaded
+        if error is not None:
+            print(f"couldn't reload {file_name}: {type(error).__name__}: {error}")  # keep showing the last good one
+        else:
+            lines, A, B, node_keys, adjacency_matrix, forces, model, solver, design = design_state
+            member_forces = forces[:-3]
+            Ax, Ay, By = forces[-3:]
+            current_node_index = None  # the node order may have changed under the mouse
+            influence = None
+            renderer.set_truss(lines, member_forces, status_text(lines, forces, A, B))
+
+    if show_influence:
+        # follows the mouse, so the whole frame is drawn
+        renderer.draw_all(pygame.mouse.get_pos())
+        if influence is None:
+            influence = influence_lines(model, node_array(node_keys))  # one factorization for the whole sweep
+        if influence[1] is not None:
+            draw_influence_line(node_array(node_keys), *influence, Vector(*pygame.mouse.get_pos()))
+        pygame.display.flip()
+    else:
+        pygame.display.update(renderer.draw(pygame.mouse.get_pos()))  # nothing at all when idle
+
+watcher.stop()
+loader.close()
 pygame.quit()
 
 
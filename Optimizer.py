@@ -1,8 +1,21 @@
+import argparse
+import os
 from vector import Vector
 import numpy as np
 import math
 import random
 from DXFextractor import *
+from truss_model import TrussModel, node_array
+from geometry import TrussGeometry
+from solution_cache import SolutionCache
+from truss_cache import load_truss
+from rigidity import check_topology, solve_checked
+from load_cases import solve_load_cases, governing_forces
+from run_stats import RunStats, profiled
+from constraints import Constraints, calculate_parallel_batch, calculate_cost_batch
+from symmetry import SymmetricDesign
+from parallel_optimizer import perturb, perturbation_mask
+from checkpoint import save_checkpoint, load_checkpoint, generator_state, restore_generator, random_state, BestExporter
 
 # copied functions
 def calculate_parallel(force):
@@ -16,28 +29,32 @@ def calculate_cost(lines, forces):
     member = 15
     cost = gusset * len(get_nodes_from_lines(lines))
     for line, force in zip(lines, forces):
-        cost += member * (line.end - line.start).norm() * calculate_parallel(force)
+        cost += member * line.length * calculate_parallel(force)
     return cost
 
 
-def is_valid(lines, forces, A, B):
-    floor_nodes = get_floor_nodes(get_nodes_from_lines(lines))
-    if B-A != Vector(12, 0):
-        return False  # "Supports A & B invalid"
+def geometry_cost(geometry, forces):
+    """ calculate_cost from a TrussGeometry's arrays, without building a Vector per member end
 
-    for i in range(len(floor_nodes) - 1):
-        if (Vector(*floor_nodes[i]) - Vector(*floor_nodes[i+1])).norm() > 3.5:
-            return False  # "Floor beams too long"
+    :param geometry: TrussGeometry
+    :param forces: member forces in the geometry's member order (the reactions after them are ignored)
+    :return: cost
+    """
+    parallel = calculate_parallel_batch(forces[:geometry.n_members], min_force, max_force)
+    return float(calculate_cost_batch(geometry.n_nodes, geometry.lengths, parallel))
 
-    for line in lines:
-        if (line.end - line.start).norm() < 1:
-            return False  # "Members too short"
 
-    for force in forces:
-        if force < min_force * calculate_parallel(force) or force > max_force * calculate_parallel(force):
-            return False  # "Force exceeded"
+def validity_reason(lines, forces, A, B):
+    """ is_valid, but says which rule the design breaks
+
+    :return: None if the design is valid, otherwise the reason
+    """
+    constraints, coordinates = Constraints.from_lines(lines, A, B, min_force=min_force, max_force=max_force)
+    return constraints.first_violation(coordinates, forces)
+
 
-    return True  # "Design Valid"
+def is_valid(lines, forces, A, B):
+    return validity_reason(lines, forces, A, B) is None
 
 
 def get_adjacency_matrix(lines, node_positons):  # this truss is bassically just a graph use DSA of graph
@@ -104,60 +121,139 @@ def randomize_positions(node_positions, A, B, selection_rate, radius, precison):
 
 
 
-file_name = 'O.DXF'
+engine = TrussModel  # stiffness.StiffnessModel also solves indeterminate (redundant member) designs
 min_force = -9  # tension
 max_force = 6  # compression
+load_cases = None  # e.g. [load_cases.moving_train(3, np.arange(0, 15.5, 0.5)), load_cases.deck_load()] to size members for the envelope
+stats_file = None  # e.g. 'run.jsonl', json lines of timings, acceptance / rejection rates and the best cost
+profile_file = None  # e.g. 'run.prof', cProfile dump of the search loop
+symmetric = True  # search the left half only and mirror it about the midline, see symmetry.py
 
-# base
-lines, (A, B) = extract_from_file(file_name)
-forces = np.round(solve_truss(lines, A, B), decimals=4)
 
-# parent stuff
-cost = calculate_cost(lines, forces)
-validity = is_valid(lines, forces[:-3], A, B)
-print("Original:", cost, validity)
+def main(file_name='O.DXF', checkpoint_file=None, resume=False, export_dir=None):
+    """ hill climbs the node positions of file_name, the cheapest design found is saved to O.DXF
 
-nodes = get_nodes_from_lines(lines)  # value indices are line indices NOT node indices
-node_keys = list(nodes.keys())
-node_keys.sort(key=lambda e: e[0])
-adjacency_matrix = get_adjacency_matrix(lines, node_keys)  # adjacency matrix will not change for a particular topology
-'''
-here modify the nodes, then test to see if it is cheaper etc
-'''
-lowest_cost = cost+2  # magic 2, remove later
-optimal = node_keys[:]
-# optimal = [(0.0, 0.0), (1.98, 3.78), (3.5, 0.0), (6.0, 0.0), (8.5, 0.0), (10.02, 3.78), (12.0, 0.0)]
-optimal   = [(0.0, 0.0), (1.96, 3.75), (3.5, 0.0), (6.0, 0.0), (8.5, 0.0), (10.04, 3.75), (12.0, 0.0)]
-optimal   = [(0.0, 0.0), (1.96, 3.75), (3.5, 0.0), (6.0, 0.0), (8.5, 0.0), (10.04, 3.75), (12.0, 0.0)]
-lowest_nodes = [Vector(*i) for i in optimal]
-lowest_nodes.sort(key=lambda e: e[0])
-
-t1 = reconstruct_lines(lowest_nodes, adjacency_matrix)
-t2 = np.round(solve_truss(t1, A, B), decimals=4)
-print(calculate_cost(t1, t2), is_valid(t1, t2[:-3], A, B))
-save_file(t1, A, B)
-quit()
-
-for j in range(10):
-    for i in range(2000):
-        new_node_positions, A, B = randomize_positions(lowest_nodes[:], A, B, 0.5, 0.04, 2)
-
-        lines2 = reconstruct_lines(new_node_positions, adjacency_matrix)
-        forces2 = np.round(solve_truss(lines2, A, B), decimals=4)
-
-        cost2 = calculate_cost(lines2, forces2)
-        validity2 = is_valid(lines2, forces2[:-3], A, B)
-        if validity2 and cost2 < lowest_cost:
-            lowest_cost = cost2
-            lowest_nodes = new_node_positions
+    :param checkpoint_file: .npz the search state is written to after every round, None to not checkpoint
+    :param resume: carry on from checkpoint_file instead of starting from the drawing
+    :param export_dir: directory every new best design is also written to (O-best-001.dxf, 002, ...)
+    :return: cheapest node positions, their cost
+    """
+    # base
+    lines, (A, B), node_keys, adjacency_matrix = load_truss(file_name)  # one array read once the drawing is cached
+    forces = np.round(engine(lines, A, B).solve(), decimals=4)
+
+    # parent stuff
+    cost = calculate_cost(lines, forces)
+    validity = is_valid(lines, forces[:-3], A, B)
+    print("Original:", cost, validity)
+
+    model = engine(reconstruct_lines(node_keys, adjacency_matrix), A, B, node_keys)  # member order matches reconstruct_lines
+    geometry = TrussGeometry.from_lines(reconstruct_lines(node_keys, adjacency_matrix), node_keys)  # same member order
+    cache = SolutionCache()  # rounded moves keep landing on layouts that were already solved
+    loads = None if load_cases is None else (tuple(load_cases), min_force, max_force)  # governing forces depend on the limits
+    constraints = Constraints.for_model(model, min_force=min_force, max_force=max_force)
+    print("Topology:", check_topology(model).reason)
+    # here modify the nodes, then test to see if it is cheaper etc
+    lowest_cost = cost+2  # magic 2, remove later
+    # optimal = [(0.0, 0.0), (1.98, 3.78), (3.5, 0.0), (6.0, 0.0), (8.5, 0.0), (10.02, 3.78), (12.0, 0.0)]
+    # optimal = [(0.0, 0.0), (1.96, 3.75), (3.5, 0.0), (6.0, 0.0), (8.5, 0.0), (10.04, 3.75), (12.0, 0.0)]
+    lowest_nodes = [Vector(*node) for node in node_keys]  # starts from the drawing
+    lowest_nodes.sort(key=lambda e: e[0])
+
+    stats = RunStats(stats_file)  # where the time goes and why moves get rejected
+    rng = np.random.default_rng()
+    first_round = 0
+    exporter = BestExporter(export_dir, file_name) if export_dir is not None else None
+    if resume:
+        saved, state = load_checkpoint(checkpoint_file)
+        if state['file_name'] != file_name or state['symmetric'] != symmetric:
+            raise ValueError(f"{checkpoint_file} is a {'symmetric' if state['symmetric'] else 'free'} run of "
+                             f"{state['file_name']}, not a {'symmetric' if symmetric else 'free'} run of {file_name}")
+        lowest_nodes = [Vector(*node) for node in saved['lowest_nodes'].tolist()]
+        lowest_cost, first_round = state['lowest_cost'], state['round'] + 1
+        rng = restore_generator(state['rng'])
+        random.setstate(random_state(state['random']))
+        if exporter is not None:
+            exporter.best_cost = state['exported']
+        print("Resuming", checkpoint_file, "at round", first_round, lowest_cost)
+    design = None
+    if symmetric:  # pairs up the nodes the search carries on from
+        start = node_array(lowest_nodes)
+        design = SymmetricDesign(start, model.a, model.b, free=perturbation_mask(start, model.a, model.b))
+        print("Design variables:", design.n_variables, "of", int(design.free.sum()))
+    with profiled(profile_file):
+        for j in range(first_round, 10):
+            for i in range(2000):
+                with stats.stage('perturb'):
+                    if design is not None:
+                        # move the leaders like randomize_positions would, the mirror images follow
+                        node_coordinates = design.apply(perturb(rng, node_array(lowest_nodes), design.mask, 1, 0.5, 0.04, 2)[0])
+                        new_node_positions = [Vector(*node) for node in node_coordinates.tolist()]
+                    else:
+                        new_node_positions, A, B = randomize_positions(lowest_nodes[:], A, B, 0.5, 0.04, 2)
+                        node_coordinates = node_array(new_node_positions)
+
+                with stats.stage('cache'):
+                    forces2 = cache.get(model, node_coordinates, loads)
+                cached = forces2 is not None
+                reason2 = None
+                if forces2 is None:
+                    with stats.stage('check'):
+                        reason2 = constraints.geometric_reason(node_coordinates)  # broken before it is even solved, skip the solve
+                    if reason2 is None:
+                        with stats.stage('solve'):
+                            forces2, check = solve_checked(model, node_coordinates)  # degenerate layouts come back as None
+                            if forces2 is not None and load_cases is not None:
+                                # one factorization for every case, members sized for the worst one
+                                forces2 = governing_forces(solve_load_cases(model, node_coordinates, load_cases), min_force, max_force)
+                        if forces2 is None:
+                            reason2 = check.reason
+                        else:
+                            forces2 = np.round(forces2, decimals=4)
+                            cache.put(model, node_coordinates, forces2, loads)
+
+                cost2 = math.inf
+                if reason2 is None:
+                    with stats.stage('score'):
+                        geometry.coordinates = node_coordinates  # lengths come from one vectorized pass
+                        cost2, reason2 = geometry_cost(geometry, forces2), constraints.force_reason(forces2[:-3])
+                # reason2 is None for a valid design
+                accepted = reason2 is None and cost2 < lowest_cost
+                if accepted:
+                    lowest_cost = cost2
+                    lowest_nodes = new_node_positions
+                    if exporter is not None:
+                        exporter.offer(reconstruct_lines(lowest_nodes, adjacency_matrix), A, B, lowest_cost)
+                stats.record(cost2, reason2, accepted, cached)
+            print(lowest_cost, cache.stats())
+            stats.emit(round=j, lowest_cost=lowest_cost, cache=cache.stats())
+            if checkpoint_file is not None:
+                save_checkpoint(checkpoint_file, {'lowest_nodes': node_array(lowest_nodes)}, {
+                    'round': j, 'lowest_cost': lowest_cost, 'file_name': file_name, 'symmetric': symmetric,
+                    'rng': generator_state(rng), 'random': random.getstate(),
+                    'exported': exporter.best_cost if exporter is not None else math.inf})
+    stats.close()
+
+    print()
+    print()
     print(lowest_cost)
+    print(node_keys)
+    print(lowest_nodes)
+    save_file(reconstruct_lines(lowest_nodes, adjacency_matrix), A, B)
+    return lowest_nodes, lowest_cost
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="hill climbing over node positions, the best design goes to O.DXF")
+    parser.add_argument('file_name', nargs='?', default='O.DXF')
+    parser.add_argument('--checkpoint', default=None, help=".npz file to write the run state to after every round")
+    parser.add_argument('--resume', action='store_true', help="carry on from --checkpoint")
+    parser.add_argument('--export-dir', default=None, help="directory to write every new best design to")
+    args = parser.parse_args()
+    if args.resume and (args.checkpoint is None or not os.path.exists(args.checkpoint)):
+        parser.error("--resume needs an existing --checkpoint")
+    main(args.file_name, args.checkpoint, args.resume, args.export_dir)
 
-print()
-print()
-print(lowest_cost)
-print(node_keys)
-print(lowest_nodes)
-save_file(reconstruct_lines(lowest_nodes, adjacency_matrix), A, B)
 # [(0.0, 0.0), (2.5000583399605594, 0.0), (6.0, 0.0), (2.243839200260678, 2.3806116098316443), (5.993252074993606, 2.636416645606335), (12.0, 0.0), (9.5, 0.0), (9.77253585845522, 2.375205636183138)]
 # [(0.0, 0.0), (2.5000041257786654, 0.0), (6.0, 0.0), (2.243839200260678, 2.3806116098316443), (5.993033329747108, 2.636136034062877), (12.0, 0.0), (9.5, 0.0), (9.77253585845522, 2.375205636183138)]
 # [(0.0, 0.0), (2.5000041257786654, 0.0), (6.0, 0.0), (2.243839200260678, 2.3806116098316443), (5.993033329747108, 2.636136034062877), (12.0, 0.0), (9.5, 0.0), (9.770614792551388, 2.3753239267825688)]
@@ -0,0 +1,222 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import numpy as np
+from DXFextractor import extract_from_file, get_nodes_from_lines, solve_truss, save_file
+from truss_model import TrussModel, node_array
+from geometry import TrussGeometry
+from rigidity import solve_checked
+import topology_search
+import Optimizer
+
+'''
+Times each stage of loading, solving and scoring a design, on the drawings in the repo and on synthetic
+Pratt trusses from 10 to 10,000 members, so a change to solve_truss, Vector or the optimizer loop can be
+compared with the run before it.
+calculate_cost, is_valid, randomize_positions, get_adjacency_matrix and reconstruct_lines are the ones in
+Optimizer.py.
+
+python benchmark.py --save-baseline              # once, on the machine the comparisons will run on
+python benchmark.py --output results.json         # later, flags anything slower than the baseline
+'''
+
+BASELINE = "benchmark_baseline.json"
+SIZES = (10, 100, 1000, 10000)  # members in the synthetic trusses
+
+
+def pratt(members, panel=1.0, height=1.5):
+    """ topology_search.pratt with about the given number of members (4 * panels - 3)
+
+    :return: list of Members, A, B
+    """
+    panels = max(3, round((members + 3) / 4))
+    return topology_search.pratt(panels, panels * panel, height)
+
+
+class Case:
+    """ one truss with everything the stages need built up front, so only the stage itself is timed """
+
+    def __init__(self, name, file_name, lines, A, B, functions):
+        self.name = name
+        self.file_name = file_name
+        self.lines, self.A, self.B = lines, A, B
+        self.node_keys = list(get_nodes_from_lines(lines).keys())
+        self.node_keys.sort(key=lambda e: e[0])
+        self.functions = functions
+        self.adjacency_matrix = functions['get_adjacency_matrix'](lines, self.node_keys)
+        self.forces = np.round(solve_truss(lines, A, B), decimals=4)
+        self.model = TrussModel(functions['reconstruct_lines'](self.node_keys, self.adjacency_matrix), A, B, self.node_keys)
+        self.geometry = TrussGeometry(self.model.coordinates, self.model.start, self.model.end)
+        self.rng = np.random.default_rng(0)
+
+    def stages(self):
+        """ stage name: function of no arguments """
+        f = self.functions
+        return {
+            'extract_from_file': lambda: extract_from_file(self.file_name),
+            'get_nodes_from_lines': lambda: get_nodes_from_lines(self.lines),
+            'solve_truss': lambda: solve_truss(self.lines, self.A, self.B),
+            'calculate_cost': lambda: f['calculate_cost'](self.lines, self.forces),
+            'is_valid': lambda: f['is_valid'](self.lines, self.forces[:-3], self.A, self.B),
+            'reconstruct_lines': lambda: f['reconstruct_lines'](self.node_keys, self.adjacency_matrix),
+            'optimizer_iteration': self.optimizer_iteration,
+        }
+
+    def optimizer_iteration(self):
+        """ one uncached pass of the search loop in Optimizer.py """
+        f = self.functions
+        candidate, A, B = f['randomize_positions'](self.node_keys[:], self.A, self.B, 0.5, 0.04, 2)
+        coordinates = node_array(candidate)
+        forces, _ = solve_checked(self.model, coordinates)
+        if forces is not None:
+            self.geometry.coordinates = coordinates
+            lines = self.geometry.members()
+            forces = np.round(forces, decimals=4)
+            f['calculate_cost'](lines, forces)
+            f['is_valid'](lines, forces[:-3], A, B)
+
+
+def drawing_cases(functions, pattern="*.[dD][xX][fF]"):
+    """ a Case for every drawing in the repo that has two anchors and solves """
+    cases = []
+    for file_name in sorted(glob.glob(pattern)):
+        try:
+            lines, anchors = extract_from_file(file_name)
+            if len(anchors) != 2 or solve_truss(lines, *anchors) is None:
+                continue
+            cases.append(Case(file_name, file_name, lines, anchors[0], anchors[1], functions))
+        except Exception:
+            continue
+    return cases
+
+
+def synthetic_cases(functions, sizes, directory):
+    """ a Case for a Pratt truss of each size, saved as a dxf so extract_from_file has something to read """
+    cases = []
+    for size in sizes:
+        lines, A, B = pratt(size)
+        file_name = os.path.join(directory, f"pratt_{len(lines)}.dxf")
+        save_file(lines, A, B, file_name)
+        cases.append(Case(f"pratt_{len(lines)}", file_name, lines, A, B, functions))
+    return cases
+
+
+def time_stage(function, repeat=5, min_time=0.05):
+    """ seconds per call, like timeit's autorange
+
+    :return: list of repeat timings (seconds per call), calls per timing
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    return [elapsed / number] + [timer.timeit(number) / number for _ in range(repeat - 1)], number
+
+
+def peak_memory(function):
+    """ peak bytes allocated during one call """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(cases, repeat=5, min_time=0.05, memory=True, stages=None, quiet=False):
+    """ times every stage of every case
+
+    :return: dict of benchmark name ("stage/case"): result dict
+    """
+    results = {}
+    for case in cases:
+        for stage, function in case.stages().items():
+            if stages and stage not in stages:
+                continue
+            function()  # warm up (caches, imports, first allocation)
+            timings, number = time_stage(function, repeat, min_time)
+            median = statistics.median(timings)
+            result = {
+                'stage': stage, 'case': case.name, 'members': len(case.lines), 'nodes': len(case.node_keys),
+                'median': median, 'min': min(timings), 'calls': number * repeat,
+                'per_second': 1 / median if median else float('inf'),
+                'members_per_second': len(case.lines) / median if median else float('inf'),
+                'peak_bytes': peak_memory(function) if memory else None,
+            }
+            results[f"{stage}/{case.name}"] = result
+            if not quiet:
+                memory_text = f"{result['peak_bytes'] / 1024:10.1f} KiB" if memory else ""
+                print(f"{stage:22s} {case.name:28s} {1e6 * median:12.1f} us {result['per_second']:10.1f}/s "
+                      f"{memory_text}", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold=1.3):
+    """ benchmarks that got slower than threshold times their baseline median
+
+    :return: list of (name, baseline median, new median, ratio)
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or not old['median']:
+            continue
+        ratio = result['median'] / old['median']
+        if ratio > threshold:
+            regressions.append((name, old['median'], result['median'], ratio))
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="per stage timings on the repo drawings and synthetic trusses")
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(SIZES), help="members in the synthetic trusses")
+    parser.add_argument('--drawings', default="*.[dD][xX][fF]", help="glob of drawings, '' to skip them")
+    parser.add_argument('--stages', nargs='*', default=None, help="only these stages")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help="seconds per timing, more calls if faster")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--output', default=None, help="json file for the results")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=1.3, help="slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+
+    functions = vars(Optimizer)
+    with tempfile.TemporaryDirectory() as directory:
+        cases = (drawing_cases(functions, args.drawings) if args.drawings else []) + \
+                synthetic_cases(functions, args.sizes, directory)
+        results = run(cases, args.repeat, args.min_time, not args.no_memory, args.stages)
+    report = {'environment': environment(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=1)
+        print("saved baseline", args.baseline, file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, old, new, ratio in regressions:
+            print(f"REGRESSION {name}: {1e6 * old:.1f} us -> {1e6 * new:.1f} us ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("no regressions against", args.baseline, file=sys.stderr)
@@ -0,0 +1,103 @@
+import glob
+import json
+import os
+import re
+import numpy as np
+from vector import Vector
+from DXFextractor import save_file
+
+'''
+Run state on disk, so a long optimizer run that is stopped (Ctrl-C, crash, a pre-empted job on a shared
+machine) carries on from its last checkpoint instead of starting again.
+A checkpoint is one .npz: the numpy arrays of the run (current and best node positions, costs) plus a json
+string holding everything else (run config, counters, random generator states). It is written to a
+temporary file and renamed over the old one, so stopping mid write leaves the previous checkpoint intact.
+BestExporter writes every new best design to its own numbered dxf instead of overwriting O.DXF.
+
+    save_checkpoint('run.npz', {'best': coordinates}, {'round': j, 'rng': generator_state(rng)})
+    arrays, meta = load_checkpoint('run.npz')
+    rng = restore_generator(meta['rng'])
+'''
+
+
+def save_checkpoint(file_name, arrays, meta):
+    """ writes arrays and json friendly meta to file_name, atomically
+
+    :param file_name: .npz file
+    :param arrays: dict of name: numpy array
+    :param meta: dict that json can write, numpy scalars are turned into floats
+    :return: None
+    """
+    temporary = file_name + '.tmp'
+    with open(temporary, 'wb') as file:  # a file object, np.savez would add .npz to the name
+        np.savez_compressed(file, meta=np.array(json.dumps(meta, default=float)), **arrays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, file_name)
+
+
+def load_checkpoint(file_name):
+    """ reads a checkpoint written by save_checkpoint
+
+    :return: dict of arrays, meta dict
+    """
+    with np.load(file_name) as data:
+        arrays = {name: data[name] for name in data.files if name != 'meta'}
+        meta = json.loads(str(data['meta']))
+    return arrays, meta
+
+
+def generator_state(rng):
+    """ json friendly state of a numpy Generator """
+    return rng.bit_generator.state
+
+
+def restore_generator(state):
+    """ numpy Generator that carries on from generator_state """
+    rng = np.random.Generator(getattr(np.random, state['bit_generator'])())
+    rng.bit_generator.state = state
+    return rng
+
+
+def random_state(state):
+    """ random.getstate() from its json form (lists instead of tuples), for random.setstate """
+    version, internal, gauss = state
+    return version, tuple(internal), gauss
+
+
+class BestExporter:
+    """ writes each new best design to <directory>/<name>-best-<version>.dxf
+    the version carries on from the files already there, so a resumed run doesn't overwrite them
+    """
+
+    def __init__(self, directory, name, best_cost=np.inf):
+        """
+        :param directory: where the dxf files go, made if it doesn't exist
+        :param name: start of the file names, usually the drawing the run started from
+        :param best_cost: only designs cheaper than this are written (the last exported cost when resuming)
+        """
+        self.directory = directory
+        self.name = os.path.splitext(os.path.basename(name))[0]
+        self.best_cost = best_cost
+        os.makedirs(directory, exist_ok=True)
+        pattern = re.compile(re.escape(self.name) + r'-best-(\d+)\.dxf$', re.IGNORECASE)
+        versions = [int(match.group(1)) for match in
+                    (pattern.search(path) for path in glob.glob(os.path.join(directory, '*'))) if match]
+        self.version = max(versions, default=0)
+        self.last = None
+
+    def offer(self, lines, A, B, cost):
+        """ saves the design if it is cheaper than the last one written
+
+        :param lines: list of Members
+        :param A: support A, Vector or (x, y)
+        :param B: support B, Vector or (x, y)
+        :return: file name it was written to, or None
+        """
+        if not cost < self.best_cost:
+            return None
+        self.version += 1
+        self.best_cost = float(cost)
+        self.last = os.path.join(self.directory, f"{self.name}-best-{self.version:03d}.dxf")
+        save_file(lines, Vector(*tuple(A)[:2]), Vector(*tuple(B)[:2]), self.last)
+        return self.last
@@ -0,0 +1,225 @@
+from collections import namedtuple
+import numpy as np
+
+'''
+The design rules from is_valid, worked out with array operations over every member (and over a batch of
+candidates) instead of a Python loop per member and a get_nodes_from_lines per call.
+The geometric rules (support spacing, floor beam spacing, member length) don't need the forces, so a
+candidate that breaks one can be thrown away before it is solved.
+violations lists every rule a design breaks with the members involved, first_violation gives the same
+answer as the old is_valid (rules in the same order).
+
+    constraints = Constraints.for_model(model)
+    if constraints.geometric_reason(coordinates) is None:
+        forces = model.solve(coordinates)
+        reason = constraints.first_violation(coordinates, forces)
+'''
+
+Violation = namedtuple('Violation', ['rule', 'members', 'nodes'])  # indices of the members / nodes involved
+
+SUPPORTS = "Supports A & B invalid"
+FLOOR_BEAMS = "Floor beams too long"
+SHORT_MEMBERS = "Members too short"
+FORCE = "Force exceeded"
+GEOMETRIC_RULES = (SUPPORTS, FLOOR_BEAMS, SHORT_MEMBERS)  # columns of geometric_batch, in is_valid order
+GUSSET_COST = 5  # per node
+MEMBER_COST = 15  # per metre of member, for each stacked member
+
+
+def calculate_parallel_batch(forces, min_force=-9, max_force=6):
+    """ array version of calculate_parallel, number of members stacked for each force
+
+    :param forces: array of member forces, tension is -ve
+    :return: array the same shape as forces, 1 to 3
+    """
+    limit = np.where(forces < 0, min_force, max_force)
+    return np.clip(np.ceil(forces / limit), 1, 3)
+
+
+def calculate_cost_batch(n_nodes, lengths, parallel):
+    """ array version of calculate_cost, gussets + members
+
+    :param n_nodes: number of nodes
+    :param lengths: (..., n_members) array of member lengths
+    :param parallel: (..., n_members) array of members stacked, from calculate_parallel_batch
+    :return: array of costs, lengths.shape[:-1]
+    """
+    return GUSSET_COST * n_nodes + MEMBER_COST * (lengths * parallel).sum(axis=-1)
+
+
+class Constraints:
+    """ is_valid for a fixed topology, the limits are kept on the object """
+
+    def __init__(self, n_nodes, start, end, a, b, min_force=-9, max_force=6, span=12, max_floor_beam=3.5,
+                 min_length=1, floor=None):
+        """
+        :param n_nodes: number of nodes
+        :param start: (n_members,) array of start node indices
+        :param end: (n_members,) array of end node indices
+        :param a: index of support A
+        :param b: index of support B
+        :param min_force: tension limit of one member (negative)
+        :param max_force: compression limit of one member
+        :param span: B has to be exactly this far right of A
+        :param max_floor_beam: longest gap between neighbouring floor nodes
+        :param min_length: shortest member
+        :param floor: (n_nodes,) bool array of the nodes that count as floor nodes when y = 0, defaults to all
+        """
+        self.n_nodes = n_nodes
+        self.start = np.asarray(start, dtype=np.intp)
+        self.end = np.asarray(end, dtype=np.intp)
+        self.n_members = len(self.start)
+        self.a, self.b = a, b
+        self.min_force, self.max_force = min_force, max_force
+        self.span = span
+        self.max_floor_beam = max_floor_beam
+        self.min_length = min_length
+        self.floor = np.ones(n_nodes, dtype=bool) if floor is None else np.asarray(floor, dtype=bool)
+        self._pairs = None
+
+    @classmethod
+    def for_model(cls, model, **limits):
+        """ constraints over the node and member order of a TrussModel """
+        return cls(model.n_nodes, model.start, model.end, model.a, model.b, **limits)
+
+    @classmethod
+    def from_lines(cls, lines, A, B, **limits):
+        """ constraints for a list of Members, like is_valid A and B don't have to be nodes of it
+        (they are added as extra nodes that aren't part of the floor if they aren't)
+
+        :return: Constraints, (n_nodes, 2) array of node positions
+        """
+        node_hash = {}
+        for line in lines:
+            node_hash.setdefault(line.start, len(node_hash))
+            node_hash.setdefault(line.end, len(node_hash))
+        n_nodes = len(node_hash)
+        start = [node_hash[line.start] for line in lines]
+        end = [node_hash[line.end] for line in lines]
+        a = node_hash.setdefault(A, len(node_hash))
+        b = node_hash.setdefault(B, len(node_hash))
+        coordinates = np.array([tuple(node) for node in node_hash], dtype=float).reshape(-1, 2)
+        floor = np.arange(len(node_hash)) < n_nodes
+        return cls(len(node_hash), start, end, a, b, floor=floor, **limits), coordinates
+
+    def lengths(self, coordinates):
+        """ member lengths, (..., n_members) for (..., n_nodes, 2) coordinates """
+        delta = coordinates[..., self.start, :] - coordinates[..., self.end, :]
+        return np.hypot(delta[..., 0], delta[..., 1])
+
+    def geometric_batch(self, coordinates, lengths=None):
+        """ the rules that don't need the forces, for a stack of candidates
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :param lengths: (batch, n_members) member lengths if they are already worked out
+        :return: (batch, 3) bool array, True where the rule in GEOMETRIC_RULES is broken
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        if lengths is None:
+            lengths = self.lengths(coordinates)
+        broken = np.empty((len(coordinates), 3), dtype=bool)
+        broken[:, 0] = np.any(coordinates[:, self.b] - coordinates[:, self.a] != (self.span, 0), axis=1)
+
+        # floor nodes sorted by x, everything off the floor sorts to the end as inf
+        floor_x = np.sort(np.where((coordinates[..., 1] == 0) & self.floor, coordinates[..., 0], np.inf), axis=1)
+        with np.errstate(invalid='ignore'):  # inf - inf past the last floor node
+            beams = np.diff(floor_x, axis=1)
+        broken[:, 1] = (np.isfinite(floor_x[:, 1:]) & (beams > self.max_floor_beam)).any(axis=1)
+
+        broken[:, 2] = (lengths < self.min_length).any(axis=1)
+        return broken
+
+    def force_batch(self, forces):
+        """ force rule for a stack of candidates
+
+        :param forces: (batch, n_members) or (batch, n_members + 3) member forces, nan for unsolved
+        :return: (batch,) bool array, True where a member is over its limit (nan counts as over)
+        """
+        member_forces = np.asarray(forces, dtype=float)[:, :self.n_members]
+        parallel = calculate_parallel_batch(np.nan_to_num(member_forces), self.min_force, self.max_force)
+        within = (member_forces >= self.min_force * parallel) & (member_forces <= self.max_force * parallel)
+        return ~within.all(axis=1)
+
+    def valid_batch(self, coordinates, forces=None, lengths=None):
+        """ whether each candidate passes every rule, just the geometric ones if forces is None
+
+        :return: (batch,) bool array
+        """
+        valid = ~self.geometric_batch(coordinates, lengths).any(axis=1)
+        if forces is not None:
+            valid &= ~self.force_batch(forces)
+        return valid
+
+    def geometric_reason(self, coordinates):
+        """ first geometric rule a single candidate breaks, None if it is fine to solve it """
+        broken = self.geometric_batch(np.asarray(coordinates, dtype=float)[None])[0]
+        return GEOMETRIC_RULES[broken.argmax()] if broken.any() else None
+
+    def force_reason(self, forces):
+        """ FORCE if a single candidate's members are over their limits, otherwise None """
+        return FORCE if self.force_batch(np.asarray(forces, dtype=float)[None])[0] else None
+
+    def first_violation(self, coordinates, forces=None):
+        """ same answer as is_valid: the first rule broken, None if the design is valid
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param forces: member forces (F1, ..., Fn, and optionally Ax, Ay, By), None to skip the force rule
+        :return: rule or None
+        """
+        reason = self.geometric_reason(coordinates)
+        if reason is None and forces is not None:
+            return self.force_reason(forces)
+        return reason
+
+    def violations(self, coordinates, forces=None):
+        """ every rule a single design breaks, with the members and nodes responsible
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param forces: member forces (F1, ..., Fn, and optionally Ax, Ay, By), None to skip the force rule
+        :return: list of Violation, empty if the design is valid
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        found = []
+        if np.any(coordinates[self.b] - coordinates[self.a] != (self.span, 0)):
+            found.append(Violation(SUPPORTS, [], [self.a, self.b]))
+
+        floor = np.flatnonzero((coordinates[:, 1] == 0) & self.floor)
+        floor = floor[np.argsort(coordinates[floor, 0], kind='stable')]
+        gaps = np.flatnonzero(np.diff(coordinates[floor, 0]) > self.max_floor_beam)
+        if len(gaps):
+            pairs = self._member_pairs()
+            members = [pairs[key] for key in (tuple(sorted((floor[i], floor[i + 1]))) for i in gaps) if key in pairs]
+            nodes = sorted(set(floor[gaps].tolist() + floor[gaps + 1].tolist()))
+            found.append(Violation(FLOOR_BEAMS, members, nodes))
+
+        short = np.flatnonzero(self.lengths(coordinates) < self.min_length)
+        if len(short):
+            found.append(Violation(SHORT_MEMBERS, short.tolist(), []))
+
+        if forces is not None:
+            member_forces = np.asarray(forces, dtype=float)[:self.n_members]
+            parallel = calculate_parallel_batch(np.nan_to_num(member_forces), self.min_force, self.max_force)
+            over = np.flatnonzero(~((member_forces >= self.min_force * parallel) &
+                                    (member_forces <= self.max_force * parallel)))
+            if len(over):
+                found.append(Violation(FORCE, over.tolist(), []))
+        return found
+
+    def _member_pairs(self):
+        """ (lower node index, higher node index): member index, only built if a floor beam report needs it """
+        if self._pairs is None:
+            low, high = np.minimum(self.start, self.end).tolist(), np.maximum(self.start, self.end).tolist()
+            self._pairs = {pair: member for member, pair in enumerate(zip(low, high))}
+        return self._pairs
+
+
+def describe(violations):
+    """ one line summary of a list of Violation for printing / the GUI """
+    if not violations:
+        return "Design Valid"
+    parts = []
+    for violation in violations:
+        indices = violation.members or violation.nodes
+        label = "members" if violation.members else "nodes"
+        parts.append(f"{violation.rule} ({label} {', '.join(str(i) for i in indices)})" if indices else violation.rule)
+    return "; ".join(parts)
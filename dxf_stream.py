@@ -0,0 +1,72 @@
+import numpy as np
+
+'''
+Streaming reader for the only two things extract_from_file needs out of a drawing: LINE endpoints and POINT
+locations in model space. ezdxf.readfile builds the whole document (header, tables, blocks, objects) before
+the query runs, this walks the group code / value pairs once and only keeps the ENTITIES section records,
+straight into coordinate arrays.
+Anything it doesn't understand (binary DXF, no ENTITIES section, a broken pair) returns None so the caller
+can fall back to ezdxf.
+
+https://help.autodesk.com/view/OARX/2018/ENU/?guid=GUID-3F0380A5-1C15-464D-BC66-2C5F094BCFB9
+'''
+
+BINARY_SENTINEL = b"AutoCAD Binary DXF"
+
+
+def _pairs(file):
+    """ (group code, value) pairs of an ascii dxf, value with surrounding whitespace stripped """
+    while True:
+        code = file.readline()
+        value = file.readline()
+        if not value:
+            return
+        yield int(code), value.strip()
+
+
+def read_entities(file_name, linetype="Continuous"):
+    """ LINE and POINT entities from the model space of an ascii dxf
+
+    :param file_name: file name of the dxf
+    :param linetype: only LINEs with this exact linetype (case sensitive, same as the ezdxf query), None for all
+    :return: (lines, 2, 2) array of start / end (x, y), (points, 2) array of (x, y), or None if it can't be read
+    """
+    with open(file_name, 'rb') as file:
+        if file.read(len(BINARY_SENTINEL)) == BINARY_SENTINEL:
+            return None
+
+    lines = []
+    points = []
+    try:
+        with open(file_name, encoding='utf-8', errors='ignore') as file:
+            in_entities = False
+            found = False
+            entity = None  # type of the entity being read, only LINE and POINT are kept
+            values = {}
+            previous = None
+            for code, value in _pairs(file):
+                if code == 0:
+                    # end of the previous entity
+                    if entity == "LINE" and values.get(67) != "1" and \
+                            (linetype is None or values.get(6, "BYLAYER") == linetype):
+                        lines.append(((float(values.get(10, 0)), float(values.get(20, 0))),
+                                      (float(values.get(11, 0)), float(values.get(21, 0)))))
+                    elif entity == "POINT" and values.get(67) != "1":
+                        points.append((float(values.get(10, 0)), float(values.get(20, 0))))
+                    entity = None
+
+                    if value == "ENDSEC" and in_entities:
+                        break
+                    if value in ("LINE", "POINT") and in_entities:
+                        entity = value
+                        values = {}
+                elif code == 2 and value == "ENTITIES" and previous == (0, "SECTION"):
+                    in_entities = found = True
+                elif entity is not None:
+                    values.setdefault(code, value)
+                previous = code, value
+    except (ValueError, UnicodeError):
+        return None
+    if not found:
+        return None
+    return np.array(lines, dtype=float).reshape(-1, 2, 2), np.array(points, dtype=float).reshape(-1, 2)
@@ -0,0 +1,155 @@
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from truss_cache import load_truss, CACHE_DIR
+from truss_model import TrussModel, node_array
+from constraints import Constraints, calculate_parallel_batch, calculate_cost_batch, describe
+from stiffness import StiffnessModel
+from rigidity import solve_checked
+
+'''
+Scores every drawing in a directory (or glob) without opening them one at a time in Optimizer.py.
+Each file is loaded (through truss_cache), solved and costed in a process pool, a file that can't be
+read or solved still gets a row saying why, so one bad drawing doesn't stop the run.
+
+python evaluate_designs.py . --output designs.csv
+python evaluate_designs.py "bridgeEC*.dxf" --output designs.json
+'''
+
+FIELDS = ['file', 'nodes', 'members', 'cost', 'valid', 'reason', 'violations', 'max_tension', 'max_compression',
+          'solve_ms', 'error']
+
+
+def find_drawings(patterns):
+    """ dxf files from a list of directories, globs and file names, each file once, sorted
+
+    :param patterns: list of strings
+    :return: list of file names
+    """
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found.update(name for name in glob.glob(os.path.join(pattern, '*'))
+                         if name.lower().endswith('.dxf') and os.path.isfile(name))
+        else:
+            found.update(name for name in glob.glob(pattern) if os.path.isfile(name))
+    return sorted(found)
+
+
+def evaluate_file(file_name, min_force=-9, max_force=6, engine=TrussModel, cache_dir=CACHE_DIR):
+    """ loads, solves and scores one drawing, never raises
+
+    :param file_name: file name of the dxf
+    :param min_force: tension limit of one member (negative)
+    :param max_force: compression limit of one member
+    :param engine: TrussModel, or StiffnessModel to allow indeterminate trusses
+    :param cache_dir: truss_cache directory, None to always parse
+    :return: dict with the FIELDS keys
+    """
+    row = dict.fromkeys(FIELDS)
+    row['file'] = file_name
+    row['valid'] = False
+    with contextlib.redirect_stdout(sys.stderr):  # bad system messages would end up in the csv
+        try:
+            _evaluate_into(row, file_name, min_force, max_force, engine, cache_dir)
+        except Exception as error:  # a drawing this can't handle is a row in the table, not the end of the run
+            row['error'] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def _evaluate_into(row, file_name, min_force, max_force, engine, cache_dir):
+    """ fills in row for evaluate_file, may raise """
+    lines, anchors, node_keys, _ = load_truss(file_name, cache_dir)
+    row['nodes'], row['members'] = len(node_keys), len(lines)
+    if len(anchors) != 2:
+        row['reason'] = f"Expected 2 anchor points, found {len(anchors)}"
+        return
+    A, B = anchors
+    model = engine(lines, A, B, node_keys)
+    coordinates = node_array(node_keys)
+
+    start = time.perf_counter()
+    forces, check = solve_checked(model, coordinates)
+    row['solve_ms'] = 1000 * (time.perf_counter() - start)
+    if forces is None:
+        row['reason'] = check.reason
+        return
+
+    forces = np.round(forces, decimals=4)
+    member_forces = forces[:model.n_members]
+    row['max_tension'] = float(min(member_forces.min(), 0))
+    row['max_compression'] = float(max(member_forces.max(), 0))
+    _, lengths = model.unit_vectors(coordinates)
+    parallel = calculate_parallel_batch(member_forces, min_force, max_force)
+    row['cost'] = float(calculate_cost_batch(model.n_nodes, lengths, parallel))
+    constraints = Constraints.for_model(model, min_force=min_force, max_force=max_force)
+    row['reason'] = constraints.first_violation(coordinates, forces)  # the rule is_valid in Optimizer.py stops at
+    row['valid'] = row['reason'] is None
+    if not row['valid']:
+        row['violations'] = describe(constraints.violations(coordinates, forces))
+
+
+def _evaluate(arguments):
+    return evaluate_file(*arguments)
+
+
+def evaluate_files(file_names, min_force=-9, max_force=6, engine=TrussModel, cache_dir=CACHE_DIR, processes=None):
+    """ evaluate_file over a process pool, results in the same order as file_names
+
+    :param processes: pool size, defaults to the number of cores, 1 runs in this process
+    :return: list of row dicts
+    """
+    jobs = [(name, min_force, max_force, engine, cache_dir) for name in file_names]
+    if processes == 1 or len(jobs) <= 1:
+        return [_evaluate(job) for job in jobs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_evaluate, jobs, chunksize=max(1, len(jobs) // (4 * (processes or os.cpu_count() or 1))))
+
+
+def rank(rows):
+    """ valid designs first, cheapest first, then the ones that failed """
+    return sorted(rows, key=lambda row: (not row['valid'], row['cost'] if row['cost'] is not None else np.inf))
+
+
+def write_rows(rows, file_name=None, fields=FIELDS):
+    """ writes the table as csv, or json if file_name ends in .json, to stdout if file_name is None """
+    if file_name is not None and file_name.lower().endswith('.json'):
+        with open(file_name, 'w') as file:
+            json.dump(rows, file, indent=1)
+        return
+    file = open(file_name, 'w', newline='') if file_name is not None else sys.stdout
+    try:
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="cost and validity of every dxf in a directory or glob")
+    parser.add_argument('paths', nargs='*', default=['.'], help="directories, globs or dxf files")
+    parser.add_argument('--output', default=None, help=".csv or .json file, prints csv if not given")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--min-force', type=float, default=-9)
+    parser.add_argument('--max-force', type=float, default=6)
+    parser.add_argument('--stiffness', action='store_true', help="use the direct stiffness engine (indeterminate trusses)")
+    parser.add_argument('--no-cache', action='store_true', help="parse every file instead of using truss_cache")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    file_names = find_drawings(args.paths)
+    rows = rank(evaluate_files(file_names, args.min_force, args.max_force,
+                               StiffnessModel if args.stiffness else TrussModel,
+                               None if args.no_cache else CACHE_DIR, args.processes))
+    write_rows(rows, args.output)
+    print(f"{len(rows)} drawings, {sum(row['valid'] for row in rows)} valid, "
+          f"{time.perf_counter() - start:.2f} s", file=sys.stderr)
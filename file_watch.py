@@ -0,0 +1,172 @@
+import os
+import queue
+import threading
+try:
+    from watchdog.observers import Observer  # inotify on linux, ReadDirectoryChangesW on windows, ...
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog is optional, the file is polled on the watcher thread instead
+    Observer = None
+    FileSystemEventHandler = object
+
+'''
+Keeps file watching and loading off the GUI's render thread.
+FileWatcher waits for the operating system to report a change to the drawing (watchdog, which uses inotify
+on linux) and only calls back once the file has stopped changing for a moment, so the half written file
+CAD leaves between the start and the end of a save isn't read. Without watchdog it polls os.stat on its
+own thread instead of the render loop.
+LatestWorker runs the loading / solving on a background thread and hands the results back through a
+queue the render loop polls every frame; requests that are overtaken by a newer one are skipped.
+
+    loader = LatestWorker(load_design)
+    watcher = FileWatcher('O.DXF', loader.submit)
+    ...
+    finished = loader.poll()  # once per frame, None until a load is done
+'''
+
+
+def file_signature(file_name):
+    """ (modification time, size) of a file, None if it isn't there (mid save) """
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Handler(FileSystemEventHandler):
+    """ sets the watcher's event for anything that touches its file, saves often go through a rename """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        paths = (getattr(event, 'src_path', None), getattr(event, 'dest_path', None))
+        if any(path and os.path.abspath(os.fsdecode(path)) == self.watcher.path for path in paths):
+            self.watcher._changed.set()
+
+
+class FileWatcher:
+    """ calls callback(file_name) from a background thread each time the file settles after a change """
+
+    def __init__(self, file_name, callback, debounce=0.25, poll_interval=0.5, start=True):
+        """
+        :param file_name: file to watch
+        :param callback: function of the file name, called on the watcher thread
+        :param debounce: seconds the file has to stay unchanged before the callback
+        :param poll_interval: seconds between os.stat calls when watchdog isn't installed
+        :param start: start watching straight away
+        """
+        self.file_name = file_name
+        self.path = os.path.abspath(file_name)
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.notifications = 0
+        self._last = file_signature(self.path)  # what is on disk now has already been loaded
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = threading.Thread(target=self._run, name="FileWatcher", daemon=True)
+        if start:
+            self.start()
+
+    @property
+    def native(self):
+        """ whether the operating system reports the changes (rather than polling) """
+        return self._observer is not None
+
+    def start(self):
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_Handler(self), os.path.dirname(self.path), recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()  # wake the thread up so it sees the stop
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._observer is not None:
+                self._changed.wait()
+            elif self._stop.wait(self.poll_interval) or file_signature(self.path) == self._last:
+                continue
+            if self._stop.is_set():
+                return
+            self._changed.clear()
+
+            # debounce, wait for a quiet spell in which the file size and time don't change
+            signature = file_signature(self.path)
+            while True:
+                if self._stop.wait(self.debounce):
+                    return
+                latest = file_signature(self.path)
+                if self._changed.is_set():  # still being written
+                    self._changed.clear()
+                elif latest == signature:
+                    break
+                signature = latest
+
+            if signature is not None and signature != self._last:
+                self._last = signature
+                self.notifications += 1
+                self.callback(self.file_name)
+
+
+class LatestWorker:
+    """ runs function on a background thread, newest request first, stale requests are dropped """
+
+    def __init__(self, function):
+        """
+        :param function: called on the worker thread with the arguments given to submit
+        """
+        self.function = function
+        self.completed = 0
+        self.skipped = 0
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="LatestWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, *args):
+        """ queues a call, safe to use from any thread """
+        self._requests.put(args)
+
+    def poll(self):
+        """ newest finished call since the last poll, doesn't block
+
+        :return: (result, None), (None, exception) or None if nothing has finished
+        """
+        latest = None
+        while True:
+            try:
+                latest = self._results.get_nowait()
+            except queue.Empty:
+                return latest
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            args = self._requests.get()
+            try:
+                while args is not None:  # a newer request makes this one out of date
+                    args = self._requests.get_nowait()
+                    self.skipped += 1
+            except queue.Empty:
+                pass
+            if args is None:
+                return
+            try:
+                self._results.put((self.function(*args), None))
+            except Exception as error:  # a half saved drawing, the next save will be picked up
+                self._results.put((None, error))
+            self.completed += 1
@@ -0,0 +1,127 @@
+import numpy as np
+from vector import Vector
+from DXFextractor import get_nodes_from_lines
+
+'''
+Struct of arrays truss geometry for the hot loops.
+Node positions live in one (n_nodes, 2) array and members are start / end index arrays, lengths and
+direction cosines are worked out for every member at once and only again after the coordinates change.
+MemberView keeps the Member interface (start, end, length) for code that still walks a list of members,
+without building and normalizing Vectors for every member on every evaluation.
+'''
+
+
+class TrussGeometry:
+    """ node coordinates plus member index arrays, with cached lengths and direction cosines """
+
+    def __init__(self, coordinates, start, end):
+        """
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param start: (n_members,) array of start node indices
+        :param end: (n_members,) array of end node indices
+        """
+        self.start = np.asarray(start, dtype=np.intp)
+        self.end = np.asarray(end, dtype=np.intp)
+        self.coordinates = coordinates
+
+    @classmethod
+    def from_lines(cls, lines, node_positions=None):
+        """ builds the index arrays from a list of Members
+
+        :param lines: list of Members
+        :param node_positions: optional list of node positions that sets the node order,
+                               defaults to the order from get_nodes_from_lines
+        :return: TrussGeometry
+        """
+        if node_positions is None:
+            node_positions = list(get_nodes_from_lines(lines).keys())
+        node_positions = [Vector(*node) for node in node_positions]
+        node_hash = {key: value for value, key in enumerate(node_positions)}
+        coordinates = np.array([tuple(node) for node in node_positions], dtype=float)
+        return cls(coordinates, [node_hash[line.start] for line in lines], [node_hash[line.end] for line in lines])
+
+    @property
+    def coordinates(self):
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self._coordinates = np.array(coordinates, dtype=float)
+        self._lengths = None  # everything derived is stale now
+
+    def move_node(self, index, position):
+        """ moves one node, the cached values are refreshed on next use
+
+        :param index: node index
+        :param position: new (x, y)
+        :return: None
+        """
+        self._coordinates[index] = tuple(position)[:2]
+        self._lengths = None
+
+    def _refresh(self):
+        if self._lengths is None:
+            delta = self._coordinates[self.end] - self._coordinates[self.start]
+            self._lengths = np.hypot(delta[:, 0], delta[:, 1])
+            self._directions = delta / self._lengths[:, None]
+
+    @property
+    def lengths(self):
+        """ (n_members,) array of member lengths """
+        self._refresh()
+        return self._lengths
+
+    @property
+    def directions(self):
+        """ (n_members, 2) array of direction cosines, start towards end """
+        self._refresh()
+        return self._directions
+
+    @property
+    def midpoints(self):
+        """ (n_members, 2) array of member midpoints """
+        return (self._coordinates[self.start] + self._coordinates[self.end]) / 2
+
+    @property
+    def n_nodes(self):
+        return len(self._coordinates)
+
+    @property
+    def n_members(self):
+        return len(self.start)
+
+    def node(self, index):
+        """ Vector of one node's position """
+        return Vector(*self._coordinates[index].tolist())
+
+    def member(self, index):
+        """ Member compatible view of one member """
+        return MemberView(self, index)
+
+    def members(self):
+        """ Member compatible views of every member, in member order """
+        return [MemberView(self, index) for index in range(self.n_members)]
+
+
+class MemberView:
+    """ reads a member out of a TrussGeometry, has the same start, end and length as a Member """
+    __slots__ = ('geometry', 'index')
+
+    def __init__(self, geometry, index):
+        self.geometry = geometry
+        self.index = index
+
+    @property
+    def start(self):
+        return self.geometry.node(self.geometry.start[self.index])
+
+    @property
+    def end(self):
+        return self.geometry.node(self.geometry.end[self.index])
+
+    @property
+    def length(self):
+        return self.geometry.lengths[self.index]
+
+    def __str__(self):
+        return f"{self.start}  ->  {self.end}"
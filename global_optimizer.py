@@ -0,0 +1,340 @@
+import argparse
+import math
+import time
+import numpy as np
+from vector import Vector
+from DXFextractor import extract_from_file, get_nodes_from_lines, save_file
+from truss_model import TrussModel, node_array
+from solution_cache import SolutionCache
+from stiffness import StiffnessModel
+from rigidity import check_topology
+from symmetry import SymmetricDesign, SYMMETRY_TOLERANCE
+from parallel_optimizer import perturbation_mask
+
+'''
+Global searches over node positions, for when the hill climb in Optimizer.py gets stuck in a local minimum
+(different starting layouts ending at 1138.6 and 1137.8 and neither able to reach the other).
+    anneal: simulated annealing, every step proposes a batch of moves around the current design and takes
+            the best of them if it is cheaper, or with probability exp(-increase / temperature) if it isn't.
+            The temperature and the move radius cool geometrically over the budget.
+    cma_es: CMA-ES evolution strategy, samples a population from a multivariate normal over the design
+            variables, moves the mean towards the cheapest members and adapts the step size and covariance.
+            Restarts with a doubled population (IPOP) when it converges and there is budget left.
+Both evaluate a whole batch / population in one stacked solve, stop on whichever of the evaluation budget,
+the time budget or the stall limit is hit first, and return the best valid design they saw.
+The design variables are the coordinates perturbation_mask lets move, or the leaders of a SymmetricDesign.
+
+python global_optimizer.py O.DXF --method cma-es --seconds 60 --seed 1 --output best.DXF
+'''
+
+
+class Search:
+    """ design variables, budget and best design so far, shared by the search methods """
+
+    def __init__(self, model, coordinates, free=None, design=None, evaluations=None, seconds=None,
+                 min_force=-9, max_force=6, cache=None):
+        """
+        :param model: TrussModel (or StiffnessModel)
+        :param coordinates: (n_nodes, 2) starting node positions
+        :param free: (n_nodes, 2) bool array of the coordinates that may move, defaults to perturbation_mask
+        :param design: SymmetricDesign, only its leaders are moved and the mirror images follow
+        :param evaluations: most candidates to evaluate, None for no limit
+        :param seconds: most wall clock time to spend, None for no limit
+        :param cache: SolutionCache to evaluate through, None to always solve
+        """
+        self.model = model
+        self.design = design
+        self.base = np.asarray(coordinates, dtype=float) if design is None else design.apply(coordinates)
+        if design is not None:
+            self.mask = design.mask
+        else:
+            self.mask = perturbation_mask(self.base, model.a, model.b) if free is None else np.asarray(free, dtype=bool)
+        self.max_evaluations = evaluations
+        self.max_seconds = seconds
+        self.min_force = min_force
+        self.max_force = max_force
+        self.cache = cache
+
+        self.start = time.perf_counter()
+        self.evaluations = 0
+        self.best = None
+        self.best_cost = math.inf
+        self.history = []  # (evaluations, seconds, cost) every time the best improves
+
+    @property
+    def n_variables(self):
+        return int(self.mask.sum())
+
+    def variables(self, coordinates):
+        return np.asarray(coordinates, dtype=float)[..., self.mask]
+
+    def coordinates(self, variables):
+        """ full node coordinates from (..., n_variables) design variables """
+        variables = np.asarray(variables, dtype=float)
+        coordinates = np.array(np.broadcast_to(self.base, variables.shape[:-1] + self.base.shape))
+        coordinates[..., self.mask] = variables
+        return coordinates if self.design is None else self.design.apply(coordinates)
+
+    def evaluate(self, variables):
+        """ scores a batch of design variables and keeps track of the best valid one
+
+        :param variables: (batch, n_variables) array
+        :return: costs (batch,), valid (batch,) bool; costs are inf for candidates that couldn't be solved
+        """
+        candidates = self.coordinates(variables)
+        if self.cache is not None:
+            _, costs, valid = self.cache.evaluate_batch(self.model, candidates, self.min_force, self.max_force)
+        else:
+            _, costs, valid = self.model.evaluate_batch(candidates, self.min_force, self.max_force)
+        self.evaluations += len(candidates)
+        scored = np.where(valid, costs, np.inf)
+        best = np.argmin(scored)
+        if scored[best] < self.best_cost:
+            self.best, self.best_cost = candidates[best].copy(), scored[best]
+            self.history.append((self.evaluations, self.seconds, self.best_cost))
+        return costs, valid
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def progress(self):
+        """ fraction of the budget used, 0 if there is no budget """
+        used = 0.0
+        if self.max_evaluations:
+            used = max(used, self.evaluations / self.max_evaluations)
+        if self.max_seconds:
+            used = max(used, self.seconds / self.max_seconds)
+        return min(used, 1.0)
+
+    def exhausted(self):
+        return ((self.max_evaluations is not None and self.evaluations >= self.max_evaluations)
+                or (self.max_seconds is not None and self.seconds >= self.max_seconds))
+
+    def stats(self, **extra):
+        return dict({'evaluations': self.evaluations, 'seconds': self.seconds, 'best_cost': self.best_cost,
+                     'n_variables': self.n_variables, 'history': self.history}, **extra)
+
+
+def anneal(search, seed=None, batch=10, selection_rate=0.5, radius=0.04, end_radius=0.005, precision=None,
+           start_temperature=5.0, end_temperature=0.01, patience=2000):
+    """ simulated annealing over the search's design variables
+
+    :param search: Search, holds the starting design, the budget and the best design found
+    :param seed: seed for the random generator
+    :param batch: moves proposed (and evaluated together) per step
+    :param selection_rate: chance of each design variable being moved in a proposal
+    :param radius: largest move at the start of the run
+    :param end_radius: largest move once the budget is used up
+    :param precision: moves are rounded to this many decimals like randomize_positions, None to not round
+    :param start_temperature: cost increase accepted with probability 1/e at the start
+    :param end_temperature: the same at the end, the cooling is geometric in between
+    :param patience: stop after this many steps without a new best design
+    :return: search.stats(), with the reason the run stopped
+    """
+    rng = np.random.default_rng(seed)
+    if search.max_evaluations is None and search.max_seconds is None:
+        search.max_evaluations = 20000  # the cooling schedule needs a budget to run over
+    current = search.variables(search.base)
+    costs, valid = search.evaluate(current[None])
+    current_cost = costs[0] if valid[0] else np.inf
+    steps = accepted = stall = 0
+
+    while True:
+        if search.exhausted():
+            stopped = "budget"
+            break
+        if stall >= patience:
+            stopped = "stalled"
+            break
+        progress = search.progress
+        temperature = start_temperature * (end_temperature / start_temperature) ** progress
+        step = radius * (end_radius / radius) ** progress
+
+        selected = rng.random((batch, len(current))) < selection_rate
+        moves = 2 * step * (rng.random((batch, len(current))) - 0.5)
+        if precision is not None:
+            moves = np.round(moves, precision)
+        proposals = current + moves * selected
+
+        best_cost = search.best_cost
+        costs, valid = search.evaluate(proposals)
+        costs = np.where(valid, costs, np.inf)
+        pick = np.argmin(costs)
+        # anything valid beats an invalid current design, otherwise the Metropolis rule
+        if np.isfinite(costs[pick]) and (not np.isfinite(current_cost) or costs[pick] < current_cost
+                                         or rng.random() < math.exp((current_cost - costs[pick]) / temperature)):
+            current, current_cost = proposals[pick], costs[pick]
+            accepted += 1
+        steps += 1
+        stall = 0 if search.best_cost < best_cost else stall + 1
+
+    return search.stats(method='anneal', steps=steps, accepted=accepted, stopped=stopped)
+
+
+def cma_es(search, seed=None, sigma=0.1, population=None, restarts=9, min_sigma=1e-6, patience=100):
+    """ CMA-ES over the search's design variables, with IPOP restarts
+
+    candidates that couldn't be solved rank last, solved but invalid ones (forces over the limit) rank
+    behind every valid one and among themselves by cost, so the search is pulled back towards valid designs
+    https://arxiv.org/abs/1604.00772 (the default parameters come from its appendix A)
+
+    :param search: Search, holds the starting design, the budget and the best design found
+    :param seed: seed for the random generator
+    :param sigma: starting step size in metres
+    :param population: candidates per generation, defaults to 4 + 3 ln(n_variables)
+    :param restarts: most restarts, each from the best design so far with twice the population
+    :param min_sigma: a run has converged once the step size drops below this
+    :param patience: a run has converged after this many generations without a new best design
+    :return: search.stats(), with the reason the run stopped
+    """
+    rng = np.random.default_rng(seed)
+    n = search.n_variables
+    if search.max_evaluations is None and search.max_seconds is None:
+        search.max_evaluations = 20000
+    search.evaluate(search.variables(search.base)[None])
+    population = population or 4 + int(3 * math.log(max(n, 1)))
+    generations = runs = 0
+    stopped = None
+
+    for runs in range(restarts + 1):
+        start = search.base if search.best is None else search.best
+        mean = search.variables(start)
+        step = sigma
+
+        # selection and adaptation parameters
+        mu = population // 2
+        weights = math.log((population + 1) / 2) - np.log(np.arange(1, mu + 1))
+        weights /= weights.sum()
+        mu_eff = 1 / (weights ** 2).sum()
+        c_c = (4 + mu_eff / n) / (n + 4 + 2 * mu_eff / n)
+        c_s = (mu_eff + 2) / (n + mu_eff + 5)
+        c_1 = 2 / ((n + 1.3) ** 2 + mu_eff)
+        c_mu = min(1 - c_1, 2 * (mu_eff - 2 + 1 / mu_eff) / ((n + 2) ** 2 + mu_eff))
+        damping = 1 + 2 * max(0, math.sqrt((mu_eff - 1) / (n + 1)) - 1) + c_s
+        chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        path_c = np.zeros(n)
+        path_s = np.zeros(n)
+        covariance = np.eye(n)
+        basis, scale = np.eye(n), np.ones(n)  # covariance = basis diag(scale^2) basis^T
+        stall = 0
+        run_generation = 0
+        while True:
+            if search.exhausted():
+                stopped = "budget"
+                break
+            if step < min_sigma or stall >= patience:
+                stopped = "converged"
+                break
+
+            steps = rng.standard_normal((population, n)) * scale @ basis.T  # ~ N(0, covariance)
+            candidates = mean + step * steps
+            best_cost = search.best_cost
+            costs, valid = search.evaluate(candidates)
+            order = np.lexsort((costs, ~valid, ~np.isfinite(costs)))[:mu]
+            stall = 0 if search.best_cost < best_cost else stall + 1
+            generations += 1
+            run_generation += 1
+
+            selected = steps[order]
+            shift = weights @ selected
+            mean = mean + step * shift
+
+            # step size from the conjugate evolution path, covariance from the evolution path and the rank mu update
+            whitened = basis @ ((basis.T @ shift) / scale)
+            path_s = (1 - c_s) * path_s + math.sqrt(c_s * (2 - c_s) * mu_eff) * whitened
+            norm_s = np.linalg.norm(path_s)
+            h_s = norm_s / math.sqrt(1 - (1 - c_s) ** (2 * run_generation)) < (1.4 + 2 / (n + 1)) * chi_n
+            path_c = (1 - c_c) * path_c + h_s * math.sqrt(c_c * (2 - c_c) * mu_eff) * shift
+            covariance = ((1 - c_1 - c_mu) * covariance
+                          + c_1 * (np.outer(path_c, path_c) + (not h_s) * c_c * (2 - c_c) * covariance)
+                          + c_mu * (selected.T * weights) @ selected)
+            step *= math.exp(min(1.0, (c_s / damping) * (norm_s / chi_n - 1)))
+
+            covariance = np.triu(covariance) + np.triu(covariance, 1).T  # keep it exactly symmetric
+            eigenvalues, basis = np.linalg.eigh(covariance)
+            scale = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+        if stopped == "budget" or runs == restarts:
+            break
+        population *= 2
+
+    return search.stats(method='cma-es', generations=generations, restarts=runs, population=population,
+                        stopped=stopped)
+
+
+METHODS = {'anneal': anneal, 'cma-es': cma_es}
+
+
+def optimize(model, coordinates, method='cma-es', evaluations=None, seconds=None, seed=None, symmetric=False,
+             min_force=-9, max_force=6, symmetry_tolerance=SYMMETRY_TOLERANCE, **options):
+    """ runs one of METHODS from coordinates
+
+    :param model: TrussModel (or StiffnessModel)
+    :param coordinates: (n_nodes, 2) starting node positions
+    :param method: key of METHODS
+    :param evaluations: most candidates to evaluate, None for no limit
+    :param seconds: most wall clock time to spend, None for no limit
+    :param seed: seed for the random generator
+    :param symmetric: only move the nodes left of the midline and mirror them (see symmetry.py)
+    :param symmetry_tolerance: how far from an exact mirror image still counts as one
+    :param options: passed on to the method, see anneal and cma_es
+    :return: best valid coordinates (or None), its cost, dict of run statistics
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    free = perturbation_mask(coordinates, model.a, model.b)
+    design = SymmetricDesign(coordinates, model.a, model.b, free, symmetry_tolerance) if symmetric else None
+    # annealing with rounded moves keeps landing on designs it has already solved
+    cache = SolutionCache() if method == 'anneal' else None
+    search = Search(model, coordinates, free, design, evaluations, seconds, min_force, max_force, cache)
+    stats = METHODS[method](search, seed=seed, **options)
+    return search.best, search.best_cost, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="simulated annealing / CMA-ES over node positions")
+    parser.add_argument('file_name', nargs='?', default='O.DXF')
+    parser.add_argument('--method', choices=sorted(METHODS), default='cma-es')
+    parser.add_argument('--evaluations', type=int, default=None, help="candidate budget")
+    parser.add_argument('--seconds', type=float, default=None, help="wall clock budget")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sigma', type=float, default=0.1, help="cma-es starting step size")
+    parser.add_argument('--population', type=int, default=None, help="cma-es starting population")
+    parser.add_argument('--radius', type=float, default=0.04, help="anneal starting move radius")
+    parser.add_argument('--temperature', type=float, default=5.0, help="anneal starting temperature")
+    parser.add_argument('--stiffness', action='store_true', help="use the direct stiffness engine (indeterminate trusses)")
+    parser.add_argument('--symmetric', action='store_true', help="mirror the left half about the midline")
+    parser.add_argument('--symmetry-tolerance', type=float, default=SYMMETRY_TOLERANCE,
+                        help="m, how far from an exact mirror image still counts as one")
+    parser.add_argument('--output', default=None, help="dxf to save the best design to")
+    args = parser.parse_args()
+
+    lines, (A, B) = extract_from_file(args.file_name)
+    node_keys = list(get_nodes_from_lines(lines).keys())
+    node_keys.sort(key=lambda e: e[0])
+    model = (StiffnessModel if args.stiffness else TrussModel)(lines, A, B, node_keys)
+    check = check_topology(model)
+    if not check.ok:
+        print(args.file_name, check.reason)
+        quit()
+
+    if args.method == 'anneal':
+        options = {'radius': args.radius, 'start_temperature': args.temperature}
+    else:
+        options = {'sigma': args.sigma, 'population': args.population}
+    _, costs, valid = model.evaluate_batch(node_array(node_keys)[None])
+    print("Original:", costs[0], valid[0])
+    best, cost, stats = optimize(model, node_array(node_keys), args.method, args.evaluations, args.seconds, args.seed,
+                                 args.symmetric, symmetry_tolerance=args.symmetry_tolerance, **options)
+    print(f"{stats['evaluations']} evaluations in {stats['seconds']:.2f} s, {stats['n_variables']} variables, "
+          f"stopped: {stats['stopped']}")
+    if best is None:
+        print("no valid design found")
+        quit()
+
+    print(cost)
+    print([tuple(node) for node in best.tolist()])
+    if args.output:
+        save_file(model.lines(best), Vector(*best[model.a].tolist()), Vector(*best[model.b].tolist()), args.output)
\ No newline at end of file
@@ -0,0 +1,215 @@
+import argparse
+import time
+import numpy as np
+from vector import Vector
+from DXFextractor import extract_from_file, get_nodes_from_lines, save_file
+from truss_model import TrussModel, node_array
+from parallel_optimizer import perturbation_mask
+from constraints import calculate_cost_batch, MEMBER_COST
+
+'''
+Gradient based node position optimizer.
+The member forces come from the linear system A(x) f = b(x), so the derivative of any weighted sum
+of forces w . f with respect to the node coordinates x only needs one extra (adjoint) solve:
+    A^T lambda = w,    d(w . f)/dx = lambda . (db/dx - dA/dx f)
+The stepwise calculate_parallel is replaced by a sum of two sigmoids so the cost has a gradient, the
+rules from is_valid become quadratic penalties and the fixed supports / floor / centreline coordinates
+are projected out. BFGS runs on the remaining free coordinates while the smoothing is tightened, and
+every iterate is scored with the real (stepwise) cost so the best valid design is what comes back.
+
+python gradient_optimizer.py O.DXF --output best.DXF
+'''
+
+
+def adjoint_gradient(model, coordinates, matrix, forces, weights):
+    """ gradient of weights . forces with respect to the node coordinates
+
+    :param model: TrussModel
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param matrix: coefficient matrix of model at coordinates
+    :param forces: solution of matrix . forces = constant_matrix
+    :param weights: (n_members + 3,) array, d(objective)/d(forces)
+    :return: (n_nodes, 2) array
+    """
+    adjoint = np.linalg.solve(matrix.T, weights).reshape(-1)[:2*model.n_nodes].reshape(-1, 2)
+    unit, lengths = model.unit_vectors(coordinates)
+
+    # d(adjoint . A f)/dx, only the member columns depend on x; d(unit)/d(start) = (I - unit unit^T) / length
+    difference = adjoint[model.start] - adjoint[model.end]
+    projected = difference - unit * (unit * difference).sum(axis=1)[:, None]
+    term = forces[:model.n_members, None] * projected / lengths[:, None]
+    gradient = np.zeros_like(coordinates)
+    np.add.at(gradient, model.start, -term)
+    np.add.at(gradient, model.end, term)
+
+    # d(adjoint . b)/dx, floor segments load their end nodes with train_dist * |dx| / 2 each
+    floor = np.flatnonzero(coordinates[:, 1] == 0)
+    floor = floor[np.argsort(coordinates[floor, 0], kind='stable')]
+    span = np.diff(coordinates[floor, 0])
+    load = model.train_dist / 2 * np.sign(span) * (adjoint[floor[:-1], 1] + adjoint[floor[1:], 1])
+    np.add.at(gradient[:, 0], floor[1:], load)
+    np.add.at(gradient[:, 0], floor[:-1], -load)
+    return gradient
+
+
+def smooth_parallel(forces, smoothing, min_force=-9, max_force=6):
+    """ differentiable stand in for calculate_parallel, steps from 1 to 2 to 3 as sigmoids
+
+    :param forces: array of member forces, tension is -ve
+    :param smoothing: width of the steps as a fraction of the force limit, smaller is closer to the real thing
+    :return: smoothed number of members, derivative with respect to the force
+    """
+    limit = np.where(forces < 0, min_force, max_force)
+    ratio = forces / limit
+    first = 1 / (1 + np.exp(-np.clip((ratio - 1) / smoothing, -50, 50)))
+    second = 1 / (1 + np.exp(-np.clip((ratio - 2) / smoothing, -50, 50)))
+    derivative = (first * (1 - first) + second * (1 - second)) / (smoothing * limit)
+    return 1 + first + second, derivative
+
+
+def smoothed_cost(model, coordinates, smoothing, penalty=1e4, min_force=-9, max_force=6):
+    """ calculate_cost with smooth_parallel plus penalties for the is_valid rules, and its gradient
+
+    :param model: TrussModel
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param smoothing: see smooth_parallel
+    :param penalty: weight of the squared constraint violations
+    :return: objective, (n_nodes, 2) gradient, forces
+    """
+    matrix = model.coefficient_matrix(coordinates)
+    forces = np.linalg.solve(matrix, model.constant_matrix(coordinates))
+    member_forces = forces[:model.n_members]
+    unit, lengths = model.unit_vectors(coordinates)
+    parallel, d_parallel = smooth_parallel(member_forces, smoothing, min_force, max_force)
+
+    # members: MEMBER_COST per metre per stacked member, gussets are fixed
+    objective = calculate_cost_batch(model.n_nodes, lengths, parallel)
+    d_lengths = MEMBER_COST * parallel
+    d_forces = MEMBER_COST * lengths * d_parallel
+
+    # members too short
+    short = np.maximum(1 - lengths, 0)
+    objective += penalty * (short ** 2).sum()
+    d_lengths -= 2 * penalty * short
+
+    # force exceeded, even three stacked members cant carry it
+    over = np.maximum(member_forces - 3 * max_force, 0) - np.maximum(3 * min_force - member_forces, 0)
+    objective += penalty * (over ** 2).sum()
+    d_forces += 2 * penalty * over
+
+    gradient = np.zeros_like(coordinates)
+    np.add.at(gradient, model.start, d_lengths[:, None] * unit)
+    np.add.at(gradient, model.end, -d_lengths[:, None] * unit)
+
+    # floor beams too long
+    floor = np.flatnonzero(coordinates[:, 1] == 0)
+    floor = floor[np.argsort(coordinates[floor, 0], kind='stable')]
+    long = np.maximum(np.diff(coordinates[floor, 0]) - 3.5, 0)
+    objective += penalty * (long ** 2).sum()
+    np.add.at(gradient[:, 0], floor[1:], 2 * penalty * long)
+    np.add.at(gradient[:, 0], floor[:-1], -2 * penalty * long)
+
+    weights = np.concatenate((d_forces, np.zeros(3)))  # the reactions don't cost anything
+    gradient += adjoint_gradient(model, coordinates, matrix, forces, weights)
+    return objective, gradient, forces
+
+
+def optimize(model, coordinates, smoothing=(0.1, 0.03, 0.01, 0.003), iterations=200, penalty=1e4,
+             tolerance=1e-8, min_force=-9, max_force=6):
+    """ BFGS over the free node coordinates, tightening the smoothing between passes
+
+    :param model: TrussModel
+    :param coordinates: (n_nodes, 2) starting node positions
+    :param smoothing: sequence of smoothing widths, one BFGS pass each
+    :param iterations: largest number of BFGS steps per pass
+    :param penalty: weight of the squared constraint violations
+    :param tolerance: a pass stops once the projected gradient norm drops below this
+    :return: best valid coordinates (or None), its real cost, number of gradient evaluations
+    """
+    free = perturbation_mask(coordinates, model.a, model.b).ravel()
+    current = coordinates.astype(float).copy()
+    best, best_cost = None, np.inf
+    evaluations = 0
+
+    def score(candidate):
+        # the real stepwise cost, this is what decides the answer
+        nonlocal best, best_cost
+        _, costs, valid = model.evaluate_batch(candidate[None], min_force, max_force)
+        if valid[0] and costs[0] < best_cost:
+            best, best_cost = candidate.copy(), costs[0]
+
+    def evaluate(candidate, width):
+        nonlocal evaluations
+        evaluations += 1
+        objective, gradient, _ = smoothed_cost(model, candidate, width, penalty, min_force, max_force)
+        return objective, gradient.ravel()[free]
+
+    score(current)
+    for width in smoothing:
+        x = current.ravel()[free]
+        objective, gradient = evaluate(current, width)
+        inverse_hessian = np.eye(len(x))
+        for _ in range(iterations):
+            if np.linalg.norm(gradient) < tolerance:
+                break
+            direction = -inverse_hessian @ gradient
+            if direction @ gradient >= 0:  # lost descent, start the curvature estimate again
+                inverse_hessian = np.eye(len(x))
+                direction = -gradient
+
+            # backtracking line search (Armijo)
+            step = 1.0
+            while step > 1e-12:
+                trial = current.copy()
+                trial.ravel()[free] = x + step * direction
+                try:
+                    trial_objective, trial_gradient = evaluate(trial, width)
+                except np.linalg.LinAlgError:  # stepped onto a mechanism
+                    trial_objective = np.inf
+                if trial_objective <= objective + 1e-4 * step * (direction @ gradient):
+                    break
+                step /= 2
+            else:
+                break
+
+            s = step * direction
+            y = trial_gradient - gradient
+            if s @ y > 1e-12:
+                rho = 1 / (s @ y)
+                identity = np.eye(len(x))
+                inverse_hessian = ((identity - rho * np.outer(s, y)) @ inverse_hessian @ (identity - rho * np.outer(y, s))
+                                   + rho * np.outer(s, s))
+            current, x, objective, gradient = trial, x + s, trial_objective, trial_gradient
+            score(current)
+
+    return best, best_cost, evaluations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="gradient based optimization of node positions")
+    parser.add_argument('file_name', nargs='?', default='O.DXF')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--penalty', type=float, default=1e4)
+    parser.add_argument('--output', default=None, help="dxf to save the best design to")
+    args = parser.parse_args()
+
+    lines, (A, B) = extract_from_file(args.file_name)
+    node_keys = list(get_nodes_from_lines(lines).keys())
+    node_keys.sort(key=lambda e: e[0])
+    model = TrussModel(lines, A, B, node_keys)
+    if not model.determinate:
+        quit()
+
+    start = time.perf_counter()
+    _, costs, valid = model.evaluate_batch(node_array(node_keys)[None])
+    print("Original:", costs[0], valid[0])
+    best, cost, evaluations = optimize(model, node_array(node_keys), iterations=args.iterations, penalty=args.penalty)
+    print(f"{evaluations} gradient evaluations in {time.perf_counter() - start:.2f} s")
+    if best is None:
+        print("no valid design found")
+        quit()
+
+    print(cost)
+    print([tuple(node) for node in best.tolist()])
+    if args.output:
+        save_file(model.lines(best), Vector(*best[model.a].tolist()), Vector(*best[model.b].tolist()), args.output)
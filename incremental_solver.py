@@ -0,0 +1,100 @@
+import numpy as np
+try:
+    from scipy.linalg import lu_factor, lu_solve
+except ImportError:  # scipy is optional, fall back to keeping the inverse
+    lu_factor = lu_solve = None
+
+
+class IncrementalSolver:
+    """ Solves a TrussModel for geometries that differ from a factorized base geometry in a few nodes
+    moving a node only changes the columns of the members that meet at it, so the new matrix is
+    base + D E^T where E picks out those columns. Sherman-Morrison-Woodbury then gives the new solution
+    from the base factorization and an r x r system (r = number of changed members), the base is
+    re-factorized once r grows past max_rank or the residual of an updated solution gets too large
+    """
+
+    def __init__(self, model, coordinates=None, max_rank=None, tolerance=1e-9):
+        """
+        :param model: TrussModel
+        :param coordinates: (n_nodes, 2) geometry to factorize first, defaults to the model's geometry
+        :param max_rank: most changed members before re-factorizing, defaults to twice the most members
+                         meeting at one node (a node and its mirror image being dragged), at least 8
+        :param tolerance: largest relative residual accepted from an update
+        """
+        self.model = model
+        if max_rank is None:
+            max_rank = max(8, 2 * np.bincount(np.concatenate((model.start, model.end))).max(initial=0))
+        self.max_rank = max_rank
+        self.tolerance = tolerance
+        self.updates = 0
+        self.refactorizations = 0
+        self.factorize(model.coordinates if coordinates is None else coordinates)
+
+    def factorize(self, coordinates):
+        """ makes coordinates the new base geometry
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: None
+        """
+        self.coordinates = np.array(coordinates, dtype=float)
+        self.matrix = self.model.coefficient_matrix(self.coordinates)
+        if lu_factor is not None:
+            self._factor = lu_factor(self.matrix, check_finite=False)
+            if not np.diag(self._factor[0]).all():  # lu_factor only warns about these
+                raise np.linalg.LinAlgError("Singular matrix")
+        else:
+            self._factor = np.linalg.inv(self.matrix)
+        self.refactorizations += 1
+
+    def _base_solve(self, rhs):
+        if lu_factor is not None:
+            return lu_solve(self._factor, rhs, check_finite=False)
+        return self._factor @ rhs
+
+    def solve(self, coordinates):
+        """ solves the truss for new node positions, topology is unchanged
+
+        :param coordinates: (n_nodes, 2) array in the same node order as the model
+        :return: F1, F2, F3, F4, ..., Ax, Ay, By
+        """
+        model = self.model
+        coordinates = np.asarray(coordinates, dtype=float)
+        constant = model.constant_matrix(coordinates)
+
+        moved = (coordinates != self.coordinates).any(axis=1)
+        changed = np.flatnonzero(moved[model.start] | moved[model.end])  # members touching a moved node
+        if len(changed) > self.max_rank:
+            self.factorize(coordinates)
+            return self._base_solve(constant)
+        if len(changed) == 0:
+            return self._base_solve(constant)
+
+        # D holds (new - base) for the changed columns, only the 4 entries at either end of each member
+        delta = coordinates[model.start[changed]] - coordinates[model.end[changed]]
+        unit = delta / np.hypot(delta[:, 0], delta[:, 1])[:, None]
+        columns = np.arange(len(changed))
+        update = np.zeros((2*model.n_nodes, len(changed)))
+        update[2*model.start[changed], columns] = unit[:, 0]
+        update[2*model.start[changed] + 1, columns] = unit[:, 1]
+        update[2*model.end[changed], columns] = -unit[:, 0]
+        update[2*model.end[changed] + 1, columns] = -unit[:, 1]
+        update -= self.matrix[:, changed]
+
+        # (A + D E^T)^-1 b = y - Z (I + E^T Z)^-1 E^T y,  y = A^-1 b,  Z = A^-1 D
+        base = self._base_solve(constant)
+        correction = self._base_solve(update)
+        try:
+            capacitance = np.eye(len(changed)) + correction[changed]
+            forces = base - correction @ np.linalg.solve(capacitance, base[changed])
+        except np.linalg.LinAlgError:
+            forces = None
+
+        if forces is not None:
+            residual = self.matrix @ forces + update @ forces[changed] - constant
+            if np.linalg.norm(residual) <= self.tolerance * max(np.linalg.norm(constant), 1):
+                self.updates += 1
+                return forces
+
+        # update went bad (singular capacitance or lost accuracy), start again from the new geometry
+        self.factorize(coordinates)
+        return self._base_solve(constant)
@@ -0,0 +1,38 @@
+import numpy as np
+from load_cases import point_loads
+
+'''
+Influence lines: the force in every member as a unit load rolls across the deck.
+Every load position is one column of a single right hand side block, so the whole sweep costs one
+factorization of the coefficient matrix instead of one solve_truss call per position.
+'''
+
+
+def influence_lines(model, coordinates=None, positions=None, resolution=0.05):
+    """ force in every member (and reaction) for a unit point load at each position on the deck
+
+    :param model: TrussModel or StiffnessModel
+    :param coordinates: (n_nodes, 2) array of node positions, defaults to the model's geometry
+    :param positions: x positions of the unit load, defaults to the whole deck every resolution metres
+    :param resolution: spacing of the default positions
+    :return: positions (k,), forces (k, n_members + 3) or None if the model can't be solved
+    """
+    if coordinates is None:
+        coordinates = model.coordinates
+    if positions is None:
+        deck = coordinates[coordinates[:, 1] == 0, 0]
+        positions = np.arange(deck.min(), deck.max() + resolution / 2, resolution)
+    forces = model.solve_many(coordinates, point_loads(model, coordinates, positions))
+    if forces is None:
+        return positions, None
+    return positions, forces.T
+
+
+def influence_extremes(positions, forces):
+    """ where on the deck a point load gives each member its largest compression and tension
+
+    :param positions: (k,) from influence_lines
+    :param forces: (k, n) from influence_lines
+    :return: position of max compression (n,), position of max tension (n,)
+    """
+    return positions[forces.argmax(axis=0)], positions[forces.argmin(axis=0)]
@@ -0,0 +1,189 @@
+import numpy as np
+from truss_model import TrussModel
+
+'''
+Load cases beyond the single full deck train load in solve_truss.
+A load case is a function case(model, coordinates) that returns a constant_matrix style vector
+(2*n_nodes, y rows hold the load going down at each node), so it can follow the geometry as nodes move.
+A case may also return a (2*n_nodes, k) block of k cases at once, moving_train does this so a whole
+sweep of train positions is built with array operations.
+solve_load_cases stacks every case into one right hand side block and solves it with a single
+factorization, force_envelope / governing_forces reduce the result to what calculate_parallel,
+calculate_cost and is_valid need.
+
+    cases = [combine(moving_train(3, np.arange(-3, 15.5, 0.5)), self_weight(0.1)), deck_load()]
+    forces = governing_forces(solve_load_cases(model, coordinates, cases))
+'''
+
+
+def _floor(coordinates):
+    """ floor (y=0) node indices sorted by x """
+    floor = np.flatnonzero(coordinates[:, 1] == 0)
+    return floor[np.argsort(coordinates[floor, 0], kind='stable')]
+
+
+def _floor_loads(n_nodes, floor, left, right):
+    """ constant_matrix vector(s) from the loads each floor segment passes to its left and right node
+
+    :param left: (segments,) or (segments, k) array
+    :param right: same shape as left
+    :return: (2*n_nodes,) or (2*n_nodes, k) array
+    """
+    constant = np.zeros((2*n_nodes,) + left.shape[1:])
+    np.add.at(constant, 2*floor[:-1] + 1, left)
+    np.add.at(constant, 2*floor[1:] + 1, right)
+    return constant
+
+
+def deck_load(intensity=TrussModel.train_dist):
+    """ uniform load over the whole deck, the default solve_truss case
+
+    :param intensity: kN/m
+    :return: load case function
+    """
+    return partial_deck_load(-np.inf, np.inf, intensity)
+
+
+def partial_deck_load(start, end, intensity=TrussModel.train_dist):
+    """ uniform load on the part of the deck between x=start and x=end
+    each floor beam is simply supported between its two floor nodes (lever rule)
+
+    :param start: x where the load starts, or an array of them for one case each
+    :param end: x where the load ends, same shape as start
+    :param intensity: kN/m
+    :return: load case function
+    """
+    start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+
+    def case(model, coordinates):
+        floor = _floor(coordinates)
+        x = coordinates[floor, 0]
+        left_x, right_x = x[:-1].reshape((-1,) + (1,)*start.ndim), x[1:].reshape((-1,) + (1,)*start.ndim)
+        loaded_start = np.clip(start, left_x, right_x)
+        loaded_end = np.clip(end, left_x, right_x)
+        total = intensity * (loaded_end - loaded_start)
+        centroid = (loaded_start + loaded_end) / 2
+        right = np.divide(total * (centroid - left_x), right_x - left_x, out=np.zeros_like(total),
+                          where=right_x > left_x)
+        return _floor_loads(model.n_nodes, floor, total - right, right)
+    return case
+
+
+def point_load(position, magnitude=1.0):
+    """ point load on the deck at x=position, shared between the two floor nodes either side of it
+
+    :param position: x of the load, off the deck means no load
+    :param magnitude: kN, down is +ve
+    :return: load case function
+    """
+    def case(model, coordinates):
+        return point_loads(model, coordinates, [position], magnitude)[:, 0]
+    return case
+
+
+def point_loads(model, coordinates, positions, magnitude=1.0):
+    """ one point load case per position, built as a single block for influence lines
+
+    :param model: TrussModel
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param positions: x positions of the load
+    :param magnitude: kN, down is +ve
+    :return: (2*n_nodes, len(positions)) array
+    """
+    floor = _floor(coordinates)
+    x = coordinates[floor, 0]
+    positions = np.asarray(positions, dtype=float)
+    segment = np.clip(np.searchsorted(x, positions, side='right') - 1, 0, len(x) - 2)
+    left_x, right_x = x[segment], x[segment + 1]
+    share = (positions - left_x) / (right_x - left_x)  # share carried by the right hand node
+    on_deck = (positions >= x[0]) & (positions <= x[-1])
+
+    constants = np.zeros((2*model.n_nodes, len(positions)))
+    cases = np.arange(len(positions))
+    np.add.at(constants, (2*floor[segment] + 1, cases), np.where(on_deck, magnitude * (1 - share), 0))
+    np.add.at(constants, (2*floor[segment + 1] + 1, cases), np.where(on_deck, magnitude * share, 0))
+    return constants
+
+
+def self_weight(weight):
+    """ weight of the members themselves, half of each member goes to either end node
+
+    :param weight: kN/m of member
+    :return: load case function
+    """
+    def case(model, coordinates):
+        _, lengths = model.unit_vectors(coordinates)
+        half = weight * lengths / 2
+        constant = np.zeros(2*model.n_nodes)
+        constant[1::2] = np.bincount(model.start, half, model.n_nodes) + np.bincount(model.end, half, model.n_nodes)
+        return constant
+    return case
+
+
+def combine(*cases):
+    """ one load case that is the sum of several, a single case is added to every column of a block
+
+    :return: load case function
+    """
+    def case(model, coordinates):
+        parts = [part(model, coordinates) for part in cases]
+        columns = max(part.shape[1] if part.ndim == 2 else 0 for part in parts)
+        if columns:
+            parts = [part if part.ndim == 2 else part[:, None] for part in parts]
+        return sum(parts)
+    return case
+
+
+def moving_train(length, positions, intensity=TrussModel.train_dist):
+    """ a train of a given length at each of several positions, one column per position
+
+    :param length: m
+    :param positions: x of the front of the train for each case
+    :param intensity: kN/m
+    :return: load case function returning a (2*n_nodes, len(positions)) block
+    """
+    positions = np.asarray(positions, dtype=float)
+    return partial_deck_load(positions - length, positions, intensity)
+
+
+def load_matrix(model, coordinates, cases):
+    """ stacks the load cases into one right hand side block
+
+    :return: (2*n_nodes, total number of cases) array
+    """
+    return np.column_stack([case(model, coordinates) for case in cases])
+
+
+def solve_load_cases(model, coordinates, cases):
+    """ solves every load case for one geometry with a single factorization
+
+    :param model: TrussModel or StiffnessModel
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param cases: list of load case functions
+    :return: (cases, n_members + 3) array, one F1, ..., Ax, Ay, By row per case, or None
+    """
+    forces = model.solve_many(coordinates, load_matrix(model, coordinates, cases))
+    return None if forces is None else forces.T
+
+
+def force_envelope(forces):
+    """ worst force over the load cases for every member (and reaction)
+
+    :param forces: (cases, n) array from solve_load_cases
+    :return: max tension (most negative, <= 0), max compression (>= 0), both (n,) arrays
+    """
+    return np.minimum(forces.min(axis=0), 0), np.maximum(forces.max(axis=0), 0)
+
+
+def governing_forces(forces, min_force=-9, max_force=6):
+    """ picks, for every member, whichever envelope force is closer to (or past) its limit
+    a member sized for that force copes with every case, so the result can go straight into
+    calculate_parallel, calculate_cost and is_valid in place of a single case's forces
+
+    :param forces: (cases, n_members + 3) array from solve_load_cases
+    :param min_force: tension limit of one member (negative)
+    :param max_force: compression limit of one member
+    :return: (n_members + 3,) array
+    """
+    tension, compression = force_envelope(forces)
+    return np.where(tension / min_force > compression / max_force, tension, compression)
@@ -0,0 +1,294 @@
+import argparse
+import multiprocessing
+import os
+import time
+import numpy as np
+from vector import Vector
+from DXFextractor import extract_from_file, get_nodes_from_lines, save_file
+from truss_model import TrussModel, node_array
+from solution_cache import SolutionCache
+from stiffness import StiffnessModel
+from rigidity import check_topology
+from symmetry import SymmetricDesign, SYMMETRY_TOLERANCE
+from checkpoint import save_checkpoint, load_checkpoint, generator_state, restore_generator, BestExporter
+
+'''
+Runs several independent hill climbing chains (the same search as the loop in Optimizer.py)
+across a process pool. Every chain has its own seeded random generator and starting perturbation,
+after each round the chains that are behind adopt the global best design and carry on from there.
+
+python parallel_optimizer.py O.DXF --chains 32 --rounds 50 --output best.DXF
+python parallel_optimizer.py O.DXF --rounds 500 --seed 1 --checkpoint run.npz --export-dir best
+python parallel_optimizer.py --checkpoint run.npz --resume --export-dir best     # after a crash or Ctrl-C
+'''
+
+CHAIN_ARRAYS = ('coordinates', 'cost', 'start_cost')  # per chain state kept as arrays in the checkpoint, the rest is json
+CHAIN_COUNTERS = ('chain', 'spawn_key', 'evaluations', 'cache_hits', 'accepted', 'adopted', 'seconds', 'history')
+
+
+def perturbation_mask(coordinates, a, b):
+    """ which coordinates randomize_positions is allowed to move
+
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param a: index of support A
+    :param b: index of support B
+    :return: (n_nodes, 2) bool array, True where the x or y of a node may change
+    """
+    free = np.ones(coordinates.shape, dtype=bool)
+    free[:, 0] = coordinates[:, 0] != 6  # centreline stays on the centreline
+    free[:, 1] = coordinates[:, 1] != 0  # floor nodes only slide along the floor
+    free[[a, b]] = False  # dont change these bad boys
+    free[((coordinates == (0, 0)) | (coordinates == (12, 0))).all(axis=1)] = False
+    return free
+
+
+def perturb(rng, coordinates, free, count, selection_rate, radius, precision):
+    """ array version of randomize_positions, makes count candidates around coordinates
+
+    :param rng: numpy Generator
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param free: mask from perturbation_mask
+    :param count: number of candidates
+    :param selection_rate: chance of each node being moved
+    :param radius: largest move in x and in y
+    :param precision: moves are rounded to this many decimals
+    :return: (count, n_nodes, 2) array of candidates
+    """
+    selected = rng.random((count, len(coordinates), 1)) < selection_rate
+    moves = np.round(2 * radius * (rng.random((count,) + coordinates.shape) - 0.5), precision)
+    return coordinates + moves * (selected & free)
+
+
+_model = None  # per worker, set by _init_worker so the model is only pickled once per process
+_cache = None
+
+
+def _init_worker(model):
+    global _model, _cache
+    _model = model
+    _cache = SolutionCache()
+
+
+def _run_chain(state):
+    """ advances one chain by one round of the hill climb
+
+    :param state: dict holding the chain's rng, current design and counters
+    :return: the updated state
+    """
+    rng = state['rng']
+    start = time.perf_counter()
+    hits = _cache.hits
+    for _ in range(state['iterations']):
+        candidates = perturb(rng, state['coordinates'], state['free'], state['batch'],
+                             state['selection_rate'], state['radius'], state['precision'])
+        if state['design'] is not None:
+            candidates = state['design'].apply(candidates)  # mirror images follow their leaders
+        _, costs, valid = _cache.evaluate_batch(_model, candidates, state['min_force'], state['max_force'])
+        state['evaluations'] += len(candidates)
+        costs = np.where(valid, costs, np.inf)
+        best = np.argmin(costs)
+        if costs[best] < state['cost']:
+            state['cost'] = costs[best]
+            state['coordinates'] = candidates[best]
+            state['accepted'] += 1
+    state['seconds'] += time.perf_counter() - start
+    state['cache_hits'] += _cache.hits - hits
+    state['history'].append(state['cost'])
+    return state
+
+
+def optimize(file_name, chains=None, rounds=10, iterations=200, batch=10, selection_rate=0.5, radius=0.04,
+             precision=2, start_radius=0.1, seed=None, min_force=-9, max_force=6, processes=None, engine=TrussModel,
+             symmetric=False, symmetry_tolerance=SYMMETRY_TOLERANCE, checkpoint=None, resume=False, export_dir=None):
+    """ runs independent hill climbing chains in a process pool, exchanging the best design every round
+
+    :param file_name: dxf to start from
+    :param chains: number of chains, defaults to the number of cores
+    :param rounds: number of exchanges
+    :param iterations: hill climbing steps per chain per round
+    :param batch: candidates evaluated together per step
+    :param selection_rate: chance of each node being moved in a step
+    :param radius: largest move per step
+    :param precision: moves are rounded to this many decimals
+    :param start_radius: size of each chain's starting perturbation (chain 0 starts from the file)
+    :param seed: seed for the whole run, each chain gets an independent stream from it
+    :param min_force: tension limit of one member (negative)
+    :param max_force: compression limit of one member
+    :param processes: pool size, defaults to chains
+    :param engine: TrussModel, or StiffnessModel to allow indeterminate trusses
+    :param symmetric: only move the nodes left of the midline and mirror them (see symmetry.py)
+    :param symmetry_tolerance: how far from an exact mirror image still counts as one
+    :param checkpoint: .npz file the run state is written to after every round, None to not checkpoint
+    :param resume: carry on from checkpoint instead of starting again (the other settings have to match
+                   the ones it was written with, see read_config)
+    :param export_dir: directory every new best design is written to as a numbered dxf, None to not export
+    :return: model, best coordinates, best cost, list of per chain statistics
+    """
+    config = {'file_name': file_name, 'chains': chains, 'rounds': rounds, 'iterations': iterations, 'batch': batch,
+              'selection_rate': selection_rate, 'radius': radius, 'precision': precision,
+              'start_radius': start_radius, 'seed': seed, 'min_force': min_force, 'max_force': max_force,
+              'engine': engine.__name__, 'symmetric': symmetric, 'symmetry_tolerance': symmetry_tolerance}
+    lines, (A, B) = extract_from_file(file_name)
+    node_keys = list(get_nodes_from_lines(lines).keys())
+    node_keys.sort(key=lambda e: e[0])
+    model = engine(lines, A, B, node_keys)
+    check = check_topology(model)
+    if not check.ok:
+        print(file_name, check.reason)
+        return model, None, None, []
+    if model.solve() is None:
+        return model, None, None, []
+
+    chains = config['chains'] = chains or multiprocessing.cpu_count()
+    coordinates = node_array(node_keys)
+    free = perturbation_mask(coordinates, model.a, model.b)
+    design = None
+    if symmetric:
+        design = SymmetricDesign(coordinates, model.a, model.b, free, symmetry_tolerance)
+        coordinates, free = design.apply(coordinates), design.mask
+    _, costs, valid = model.evaluate_batch(coordinates[None], min_force, max_force)
+    base_cost = costs[0] if valid[0] else np.inf
+
+    settings = {'free': free, 'design': design, 'iterations': iterations, 'batch': batch,
+                'selection_rate': selection_rate, 'radius': radius, 'precision': precision,
+                'min_force': min_force, 'max_force': max_force}
+    done, exported = 0, np.inf
+    if resume:
+        states, done, exported = restore_chains(checkpoint, settings)
+        print(f"resuming {checkpoint} after round {done}")
+    else:
+        states = start_chains(model, coordinates, base_cost, chains, seed, start_radius, settings)
+    exporter = BestExporter(export_dir, file_name, exported) if export_dir is not None else None
+
+    with multiprocessing.Pool(processes or len(states), initializer=_init_worker, initargs=(model,)) as pool:
+        for done in range(done + 1, rounds + 1):
+            states = pool.map(_run_chain, states)
+            leader = min(states, key=lambda e: e['cost'])
+            for state in states:
+                if state['cost'] > leader['cost']:  # exchange: fall behind, carry on from the best design
+                    state['coordinates'] = leader['coordinates'].copy()
+                    state['cost'] = leader['cost']
+                    state['adopted'] += 1
+            if exporter is not None:
+                best = leader['coordinates']
+                exporter.offer(model.lines(best), best[model.a].tolist(), best[model.b].tolist(), leader['cost'])
+            if checkpoint is not None:
+                save_chains(checkpoint, states, done, config, exporter.best_cost if exporter is not None else np.inf)
+
+    leader = min(states, key=lambda e: e['cost'])
+    stats = [{key: state[key] for key in ('start_cost', 'cost') + CHAIN_COUNTERS} for state in states]
+    return model, leader['coordinates'], leader['cost'], stats
+
+
+def start_chains(model, coordinates, base_cost, chains, seed, start_radius, settings):
+    """ one state per chain, each with its own random stream and starting perturbation
+
+    :param settings: dict of the per chain settings (free, design, iterations, ...), copied into every state
+    :return: list of state dicts
+    """
+    states = []
+    for i, seed_sequence in enumerate(np.random.SeedSequence(seed).spawn(chains)):
+        rng = np.random.default_rng(seed_sequence)
+        start, cost = coordinates, base_cost
+        if i > 0:
+            # starting perturbation, kept only if it is still a valid design
+            candidate = perturb(rng, coordinates, settings['free'], 1, 1, start_radius, settings['precision'])
+            if settings['design'] is not None:
+                candidate = settings['design'].apply(candidate)
+            _, costs, valid = model.evaluate_batch(candidate, settings['min_force'], settings['max_force'])
+            if valid[0]:
+                start, cost = candidate[0], costs[0]
+        states.append(dict(settings, **{
+            'chain': i, 'spawn_key': seed_sequence.spawn_key, 'rng': rng,
+            'coordinates': start, 'cost': cost, 'start_cost': cost,
+            'evaluations': 0, 'cache_hits': 0, 'accepted': 0, 'adopted': 0, 'seconds': 0.0, 'history': [],
+        }))
+    return states
+
+
+def save_chains(file_name, states, done, config, exported=np.inf):
+    """ checkpoints the chains after a round
+
+    :param states: list of chain state dicts
+    :param done: number of rounds finished
+    :param config: the optimize arguments of the run, what read_config gives back
+    :param exported: cost of the last design BestExporter wrote
+    :return: None
+    """
+    arrays = {key: np.array([state[key] for state in states], dtype=float) for key in CHAIN_ARRAYS}
+    meta = {'done': done, 'config': config, 'exported': exported,
+            'rng': [generator_state(state['rng']) for state in states],
+            'chains': [{key: state[key] for key in CHAIN_COUNTERS} for state in states]}
+    save_checkpoint(file_name, arrays, meta)
+
+
+def restore_chains(file_name, settings):
+    """ the chains as save_chains left them
+
+    :param settings: dict of the per chain settings, see start_chains
+    :return: list of state dicts, number of rounds finished, cost of the last exported design
+    """
+    arrays, meta = load_checkpoint(file_name)
+    states = []
+    for i, (counters, state) in enumerate(zip(meta['chains'], meta['rng'])):
+        states.append(dict(settings, **counters, **{key: arrays[key][i] for key in CHAIN_ARRAYS},
+                           rng=restore_generator(state)))
+    return states, meta['done'], meta['exported']
+
+
+def read_config(file_name):
+    """ the optimize arguments a checkpoint was written with, engine as the class
+
+    :return: dict
+    """
+    _, meta = load_checkpoint(file_name)
+    config = dict(meta['config'])
+    config['engine'] = {'TrussModel': TrussModel, 'StiffnessModel': StiffnessModel}[config['engine']]
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="parallel hill climbing over node positions")
+    parser.add_argument('file_name', nargs='?', default='O.DXF')
+    parser.add_argument('--chains', type=int, default=None)
+    parser.add_argument('--rounds', type=int, default=None, help="default 10, or the checkpoint's with --resume")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=0.04)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stiffness', action='store_true', help="use the direct stiffness engine (indeterminate trusses)")
+    parser.add_argument('--symmetric', action='store_true', help="mirror the left half about the midline")
+    parser.add_argument('--symmetry-tolerance', type=float, default=SYMMETRY_TOLERANCE,
+                        help="m, how far from an exact mirror image still counts as one")
+    parser.add_argument('--output', default=None, help="dxf to save the best design to")
+    parser.add_argument('--checkpoint', default=None, help=".npz file to write the run state to after every round")
+    parser.add_argument('--resume', action='store_true',
+                        help="carry on from --checkpoint with the settings it was written with")
+    parser.add_argument('--export-dir', default=None, help="directory to write every new best design to")
+    args = parser.parse_args()
+
+    if args.resume:
+        if args.checkpoint is None or not os.path.exists(args.checkpoint):
+            parser.error("--resume needs an existing --checkpoint")
+        config = read_config(args.checkpoint)
+        if args.rounds is not None:
+            config['rounds'] = args.rounds  # run on for longer than first planned
+    else:
+        config = {'file_name': args.file_name, 'chains': args.chains, 'rounds': args.rounds or 10,
+                  'iterations': args.iterations, 'batch': args.batch, 'radius': args.radius, 'seed': args.seed,
+                  'engine': StiffnessModel if args.stiffness else TrussModel, 'symmetric': args.symmetric,
+                  'symmetry_tolerance': args.symmetry_tolerance}
+    model, best, cost, stats = optimize(**config, checkpoint=args.checkpoint, resume=args.resume,
+                                        export_dir=args.export_dir)
+    if best is None:
+        quit()
+
+    for chain in stats:
+        print(f"chain {chain['chain']}: {chain['start_cost']:.2f} -> {chain['cost']:.2f}, "
+              f"{chain['evaluations']} evaluations ({chain['cache_hits']} cached), {chain['accepted']} accepted, "
+              f"{chain['adopted']} adopted, {chain['evaluations'] / chain['seconds']:.0f} eval/s")
+    print()
+    print(cost)
+    print([tuple(node) for node in best.tolist()])
+    if args.output:
+        save_file(model.lines(best), Vector(*best[model.a].tolist()), Vector(*best[model.b].tolist()), args.output)
@@ -0,0 +1,186 @@
+from collections import namedtuple
+import numpy as np
+
+'''
+Checks that are cheaper than a solve and say why a truss can't be solved.
+check_topology runs the (2, 3) pebble game once per topology (Laman's condition: a 2D truss of n nodes is
+rigid when it has 2n - 3 independent members, so every subset of k nodes uses at most 2k - 3 of them).
+check_geometry looks for the degenerate layouts the pebble game can't see: zero length members, two
+collinear members meeting at an otherwise free joint and supports that can't hold the truss still.
+Both return a Check instead of raising, so the optimizer can throw a candidate away and carry on.
+
+https://en.wikipedia.org/wiki/Laman_graph
+'''
+
+Check = namedtuple('Check', ['ok', 'reason', 'members'])  # members: indices of the members involved
+
+RIGID = "Rigid"
+INDETERMINATE = "Statically indeterminate"  # rigid with redundant members, needs StiffnessModel
+MECHANISM = "Mechanism"
+SUPPORTS = "Supports can't hold the truss"
+ZERO_LENGTH = "Zero length member"
+COLLINEAR = "Collinear members at a two member joint"
+SINGULAR = "Singular matrix"
+ILL_CONDITIONED = "Ill conditioned"
+
+
+def pebble_game(n_nodes, start, end):
+    """ (2, 3) pebble game, splits the members into independent and redundant ones
+
+    :param n_nodes: number of nodes
+    :param start: array of start node indices per member
+    :param end: array of end node indices per member
+    :return: list of redundant member indices, number of independent members
+    """
+    pebbles = [2] * n_nodes
+    covers = [[] for _ in range(n_nodes)]  # covers[u]: nodes v where the pebble on u covers edge u -> v
+
+    def gather(root, blocked):
+        # depth first search along the directed edges for a free pebble, then reverse the path
+        parent = {root: None}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for other in covers[node]:
+                if other in parent or other in blocked:
+                    continue
+                parent[other] = node
+                if pebbles[other]:
+                    pebbles[other] -= 1
+                    pebbles[root] += 1
+                    while parent[other] is not None:
+                        previous = parent[other]
+                        covers[previous].remove(other)
+                        covers[other].append(previous)
+                        other = previous
+                    return True
+                stack.append(other)
+        return False
+
+    redundant = []
+    independent = 0
+    for index, (u, v) in enumerate(zip(start, end)):
+        u, v = int(u), int(v)
+        # the edge is independent if 4 pebbles (l + 1) can be gathered on its two ends
+        while pebbles[u] + pebbles[v] < 4:
+            if not (pebbles[u] < 2 and gather(u, {u, v})) and not (pebbles[v] < 2 and gather(v, {u, v})):
+                break
+        if pebbles[u] + pebbles[v] < 4:
+            redundant.append(index)
+            continue
+        if pebbles[u]:
+            pebbles[u] -= 1
+            covers[u].append(v)
+        else:
+            pebbles[v] -= 1
+            covers[v].append(u)
+        independent += 1
+    return redundant, independent
+
+
+def check_topology(model):
+    """ whether the member layout of a model can be rigid at all, run once per topology
+
+    :param model: TrussModel
+    :return: Check, reason is RIGID, INDETERMINATE or MECHANISM
+    """
+    redundant, independent = pebble_game(model.n_nodes, model.start, model.end)
+    if independent < 2*model.n_nodes - 3:
+        return Check(False, MECHANISM, redundant)
+    if redundant:
+        return Check(True, INDETERMINATE, redundant)
+    return Check(True, RIGID, [])
+
+
+def _two_bar_joints(model):
+    """ joints held by exactly two bars, a support reaction counts as a bar
+    their two bars must not be collinear, found once per model and kept on it
+
+    :return: (joints, 2) member indices, -1 means the vertical support bar and -2 the horizontal one
+    """
+    if getattr(model, '_two_bar_joints', None) is None:
+        bars = [[] for _ in range(model.n_nodes)]
+        for member, (s, e) in enumerate(zip(model.start, model.end)):
+            bars[s].append(member)
+            bars[e].append(member)
+        bars[model.a] += [-2, -1]  # Ax, Ay
+        bars[model.b] += [-1]  # By
+        model._two_bar_joints = np.array([pair for pair in bars if len(pair) == 2], dtype=np.intp).reshape(-1, 2)
+    return model._two_bar_joints
+
+
+def check_geometry_batch(model, coordinates, tolerance=1e-9):
+    """ vectorized check_geometry, just the pass / fail of each candidate
+
+    :param model: TrussModel
+    :param coordinates: (batch, n_nodes, 2) array of node positions
+    :return: (batch,) bool array, True where the geometry isn't degenerate
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    delta = coordinates[:, model.start] - coordinates[:, model.end]
+    lengths = np.hypot(delta[..., 0], delta[..., 1])
+    ok = (lengths > tolerance).all(axis=1)
+    ok &= np.abs(coordinates[:, model.b, 0] - coordinates[:, model.a, 0]) > tolerance
+
+    joints = _two_bar_joints(model)
+    if len(joints):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            unit = np.concatenate((delta / lengths[..., None], np.broadcast_to([[[1, 0], [0, 1]]], (len(delta), 2, 2))), axis=1)
+        first, second = unit[:, joints[:, 0]], unit[:, joints[:, 1]]  # -2, -1 index the support bars at the end
+        cross = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+        ok &= (np.abs(cross) > tolerance).all(axis=1)
+    return ok
+
+
+def check_geometry(model, coordinates, tolerance=1e-9):
+    """ cheap per geometry check, catches the layouts that make the coefficient matrix singular
+
+    :param model: TrussModel
+    :param coordinates: (n_nodes, 2) array of node positions
+    :return: Check, reason is RIGID, SUPPORTS, ZERO_LENGTH or COLLINEAR
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    delta = coordinates[model.start] - coordinates[model.end]
+    lengths = np.hypot(delta[:, 0], delta[:, 1])
+    short = np.flatnonzero(lengths <= tolerance)
+    if len(short):
+        return Check(False, ZERO_LENGTH, short.tolist())
+
+    if abs(coordinates[model.b, 0] - coordinates[model.a, 0]) <= tolerance:
+        return Check(False, SUPPORTS, [])  # Ay and By on one vertical line, nothing resists the moment
+
+    joints = _two_bar_joints(model)
+    if len(joints):
+        unit = np.concatenate((delta / lengths[:, None], [[1, 0], [0, 1]]))
+        first, second = unit[joints[:, 0]], unit[joints[:, 1]]
+        cross = first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0]
+        bad = joints[np.abs(cross) <= tolerance]
+        if len(bad):
+            return Check(False, COLLINEAR, sorted(set(bad[bad >= 0].tolist())))
+    return Check(True, RIGID, [])
+
+
+def solve_checked(model, coordinates=None, max_force_ratio=1e8):
+    """ model.solve behind the geometry check, never raises for a bad layout
+
+    :param model: TrussModel (or StiffnessModel)
+    :param coordinates: (n_nodes, 2) array of node positions, defaults to the model's geometry
+    :param max_force_ratio: forces this many times the total load mean the matrix was nearly singular
+    :return: forces or None, Check
+    """
+    if coordinates is None:
+        coordinates = model.coordinates
+    check = check_geometry(model, coordinates)
+    if not check.ok:
+        return None, check
+    try:
+        forces = model.solve(coordinates)
+    except np.linalg.LinAlgError:
+        return None, Check(False, SINGULAR, [])
+    if forces is None:
+        return None, check_topology(model)
+
+    load = max(np.abs(model.constant_matrix(coordinates)).sum(), 1)
+    if not np.isfinite(forces).all() or np.abs(forces).max() > max_force_ratio * load:
+        return None, Check(False, ILL_CONDITIONED, [])
+    return forces, check
@@ -0,0 +1,130 @@
+import cProfile
+import contextlib
+import json
+import time
+from collections import Counter, defaultdict
+
+'''
+Counters and timers for an optimizer run: where the time goes (per stage), evaluations per second, how
+often moves are accepted and why the rest are rejected, and the best cost over time.
+Written out as json lines, one per emit, so a long run can be followed with tail -f and loaded with
+pandas.read_json(file_name, lines=True) afterwards.
+
+    stats = RunStats('run.jsonl')
+    with stats.stage('solve'):
+        forces = model.solve(coordinates)
+    stats.record(cost, reason, accepted)
+    stats.emit(round=j, cache=cache.stats())
+'''
+
+NOT_CHEAPER = "Not cheaper"  # rejection reason for a valid design that doesn't beat the best so far
+
+
+class RunStats:
+    """ per stage timers, acceptance / rejection counts and the best cost trajectory of a run """
+
+    def __init__(self, file_name=None, clock=time.perf_counter):
+        """
+        :param file_name: json lines file to append to, None to only keep the numbers in memory
+        :param clock: function returning seconds
+        """
+        self.clock = clock
+        self.start = clock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.evaluations = 0
+        self.cached = 0
+        self.accepted = 0
+        self.rejected = Counter()
+        self.best_cost = None
+        self.trajectory = []  # (evaluation, seconds, cost) every time the best improves
+        self._file = open(file_name, 'a') if file_name is not None else None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ times the body of a with block under name """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += self.clock() - start
+            self.stage_calls[name] += 1
+
+    def record(self, cost, reason=None, accepted=False, cached=False):
+        """ counts one evaluated candidate
+
+        :param cost: cost of the candidate
+        :param reason: why it is invalid (is_valid failure or rigidity reason), None if valid
+        :param accepted: whether it replaced the best design
+        :param cached: whether it came out of the SolutionCache
+        :return: None
+        """
+        self.evaluations += 1
+        self.cached += cached
+        if accepted:
+            self.accepted += 1
+            self.improved(cost)
+        else:
+            self.rejected[reason if reason is not None else NOT_CHEAPER] += 1
+
+    def improved(self, cost):
+        """ adds a point to the best cost trajectory and writes it out """
+        self.best_cost = cost
+        point = (self.evaluations, self.clock() - self.start, cost)
+        self.trajectory.append(point)
+        self._write({'event': 'best', 'evaluation': point[0], 'seconds': point[1], 'cost': cost})
+
+    def snapshot(self, **extra):
+        """ everything so far as a json friendly dict, extra keys are added as they are """
+        seconds = self.clock() - self.start
+        staged = sum(self.stage_seconds.values())
+        return dict({
+            'event': 'stats',
+            'seconds': seconds,
+            'evaluations': self.evaluations,
+            'evaluations_per_second': self.evaluations / seconds if seconds else 0.0,
+            'cache_hit_rate': self.cached / self.evaluations if self.evaluations else 0.0,
+            'acceptance_rate': self.accepted / self.evaluations if self.evaluations else 0.0,
+            'rejections': {reason: {'count': count, 'rate': count / self.evaluations}
+                           for reason, count in self.rejected.most_common()},
+            'stages': {name: {'seconds': self.stage_seconds[name], 'calls': self.stage_calls[name],
+                              'share': self.stage_seconds[name] / staged if staged else 0.0}
+                       for name in self.stage_seconds},
+            'best_cost': self.best_cost,
+        }, **extra)
+
+    def emit(self, **extra):
+        """ writes a snapshot as one json line
+
+        :return: the snapshot
+        """
+        snapshot = self.snapshot(**extra)
+        self._write(snapshot)
+        return snapshot
+
+    def _write(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record, default=float) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+@contextlib.contextmanager
+def profiled(file_name=None):
+    """ runs the body of a with block under cProfile and dumps the stats to file_name (for snakeviz,
+    pstats, ...), does nothing if file_name is None
+    """
+    if file_name is None:
+        yield None
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(file_name)
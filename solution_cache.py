@@ -0,0 +1,105 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class SolutionCache:
+    """ Bounded LRU cache of solved geometries
+    key is the model's topology, what it was loaded with and the node coordinates rounded to decimals,
+    value is the solved forces (F1, ..., Ax, Ay, By, nan where the geometry couldn't be solved).
+    Cost and validity depend on the force limits as well, so every caller works them out from the forces
+    randomize_positions rounds its moves, so late in a run most candidates have been seen before
+    """
+
+    def __init__(self, maxsize=100000, decimals=6):
+        """
+        :param maxsize: most geometries kept, the least recently used one is dropped past this
+        :param decimals: coordinates closer than this are treated as the same geometry
+        """
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def key(self, model, coordinates, loads=None):
+        """ hashable key for a geometry of model
+
+        :param model: TrussModel
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param loads: hashable identity of what the forces were solved for (load cases, plus the force limits
+                      if governing_forces picked between them), None for the model's own deck load
+        :return: tuple
+        """
+        quantized = np.round(np.asarray(coordinates, dtype=float), self.decimals) + 0.0  # + 0.0 turns -0.0 into 0.0
+        return model.topology, loads, quantized.tobytes()
+
+    def get(self, model, coordinates, loads=None):
+        """ looks a geometry up, counts a hit or a miss
+
+        :return: the stored forces or None
+        """
+        key = self.key(model, coordinates, loads)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, model, coordinates, forces, loads=None):
+        """ stores the forces of a geometry, evicting the least recently used one if full
+
+        :return: None
+        """
+        key = self.key(model, coordinates, loads)
+        self._entries[key] = forces
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def evaluate(self, model, coordinates, min_force=-9, max_force=6):
+        """ forces, cost and validity of one geometry, solved only if it hasn't been seen
+
+        :param model: TrussModel
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: forces, cost, valid
+        """
+        forces, costs, valid = self.evaluate_batch(model, np.asarray(coordinates, dtype=float)[None], min_force, max_force)
+        return forces[0], costs[0], valid[0]
+
+    def evaluate_batch(self, model, coordinates, min_force=-9, max_force=6):
+        """ TrussModel.evaluate_batch that only solves the candidates not already in the cache
+
+        :param model: TrussModel
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: forces (batch, n_members + 3), costs (batch,), valid (batch,) bool
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        entries = [self.get(model, candidate) for candidate in coordinates]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            forces = model.forces_batch(coordinates[missing])
+            for j, i in enumerate(missing):
+                entries[i] = forces[j]
+                self.put(model, coordinates[i], entries[i])
+        forces = np.array(entries).reshape(len(coordinates), model.n_members + 3)
+        costs, valid = model.score_batch(coordinates, forces, min_force, max_force)  # the limits aren't in the key
+        return forces, costs, valid
+
+    def stats(self):
+        """ counters for reporting
+
+        :return: dict of hits, misses, evictions, size and hit_rate
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,132 @@
+import numpy as np
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+except ImportError:  # scipy is optional, everything falls back to a dense Cholesky
+    sparse = None
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky  # optional, sparse Cholesky
+except ImportError:
+    cholmod_cholesky = None
+from truss_model import TrussModel
+
+'''
+Direct stiffness method, works for statically indeterminate trusses as well as determinate ones.
+Every member is an axial spring EA/L between its two nodes, the springs are assembled into the global
+stiffness matrix K, the support degrees of freedom (Ax, Ay at A, By at B) are removed and K d = P is solved
+for the node displacements d. Member forces come from the stretch of each member.
+For a determinate truss the forces don't depend on EA and match solve_truss exactly.
+
+https://www.ae.msstate.edu/vlsm/truss/statically_det_indet_trusses/statically_det_indet_trusses.htm
+'''
+
+
+class StiffnessModel(TrussModel):
+    """ Drop in replacement for TrussModel that solves with the direct stiffness method
+    same node/member index arrays, same output (F1, ..., Fn, Ax, Ay, By with compression +ve)
+    but any number of members is accepted as long as the truss is not a mechanism
+    """
+
+    def __init__(self, lines, A, B, node_positions=None, stiffness=1.0):
+        """
+        :param lines: list of Members
+        :param A: Vector, pinned support (Ax, Ay)
+        :param B: Vector, roller support (By)
+        :param node_positions: optional list of node positions that sets the node order
+        :param stiffness: EA of every member, scalar or (n_members,) array, only matters if indeterminate
+        """
+        super().__init__(lines, A, B, node_positions)
+        self.stiffness = np.broadcast_to(np.asarray(stiffness, dtype=float), (self.n_members,))
+
+        # each member adds a 4x4 block over the dofs (start x, start y, end x, end y)
+        dofs = np.stack((2*self.start, 2*self.start + 1, 2*self.end, 2*self.end + 1), axis=1)
+        self._block_rows = np.repeat(dofs, 4, axis=1).ravel()
+        self._block_cols = np.tile(dofs, (1, 4)).ravel()
+        self.supports = np.array([2*self.a, 2*self.a + 1, 2*self.b + 1])  # Ax, Ay, By
+        self.free = np.setdiff1d(np.arange(2*self.n_nodes), self.supports)
+
+    def stiffness_matrix(self, coordinates):
+        """ global stiffness matrix, sparse above sparse_threshold if scipy is installed
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: (2*n_nodes, 2*n_nodes) matrix
+        """
+        unit, lengths = self.unit_vectors(coordinates)
+        outer = unit[:, :, None] * unit[:, None, :] * (self.stiffness / lengths)[:, None, None]
+        blocks = np.block([[outer, -outer], [-outer, outer]])  # (n_members, 4, 4)
+        size = 2*self.n_nodes
+        if sparse is not None and size > self.sparse_threshold:
+            return sparse.csc_matrix((blocks.ravel(), (self._block_rows, self._block_cols)), shape=(size, size))
+        flat = np.bincount(self._block_rows * size + self._block_cols, blocks.ravel(), size * size)
+        return flat.reshape(size, size)
+
+    def solve(self, coordinates=None):
+        """ solves the truss for a set of node positions
+
+        :param coordinates: (n_nodes, 2) array in the same node order as the model,
+                            defaults to the geometry the model was built with
+        :return: F1, F2, F3, F4, ..., Ax, Ay, By or None if there are too few members
+        """
+        if coordinates is None:
+            coordinates = self.coordinates
+        forces = self.solve_many(coordinates, self.constant_matrix(coordinates)[:, None])
+        return None if forces is None else forces[:, 0]
+
+    def solve_many(self, coordinates, constants):
+        """ solves one geometry for many load cases, K is only factorized once
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param constants: (2*n_nodes, cases) array, loads laid out like constant_matrix (down is +ve)
+        :return: (n_members + 3, cases) array or None if there are too few members
+        """
+        if self.n_members + 3 < 2*self.n_nodes:
+            # not enough members to be rigid, some nodes are free to move
+            self.print_bad_system()
+            return None
+        stiffness = self.stiffness_matrix(coordinates)
+        loads = -np.asarray(constants, dtype=float)  # constant_matrix holds the load going down as +ve
+
+        reduced = stiffness[self.free][:, self.free]
+        displacements = np.zeros(loads.shape)
+        displacements[self.free] = self._solve_reduced(reduced, loads[self.free])
+
+        # stretch of each member gives the tension, this repo uses compression +ve
+        unit, lengths = self.unit_vectors(coordinates)
+        d = displacements.reshape(self.n_nodes, 2, -1)
+        stretch = (unit[:, :, None] * (d[self.start] - d[self.end])).sum(axis=1)
+        tension = (self.stiffness / lengths)[:, None] * stretch
+        reactions = (stiffness @ displacements)[self.supports] - loads[self.supports]
+        return np.concatenate((-tension, reactions))
+
+    def solve_batch(self, coordinates):
+        """ solve for each candidate geometry, rows are nan where the truss is a mechanism
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: (batch, n_members + 3) array, None if there are too few members
+        """
+        if self.n_members + 3 < 2*self.n_nodes:
+            self.print_bad_system()
+            return None
+        forces = np.full((len(coordinates), self.n_members + 3), np.nan)
+        for i, candidate in enumerate(np.asarray(coordinates, dtype=float)):
+            try:
+                forces[i] = self.solve(candidate)
+            except np.linalg.LinAlgError:
+                pass
+        return forces
+
+    @staticmethod
+    def _solve_reduced(matrix, rhs):
+        """ K_ff d_f = P_f, K_ff is symmetric positive definite unless the truss is a mechanism """
+        if isinstance(matrix, np.ndarray):
+            factor = np.linalg.cholesky(matrix)
+            return np.linalg.solve(factor.T, np.linalg.solve(factor, rhs))
+        if cholmod_cholesky is not None:
+            try:
+                return cholmod_cholesky(matrix)(rhs)
+            except Exception:  # cholmod raises its own CholmodNotPositiveDefiniteError
+                raise np.linalg.LinAlgError("Singular matrix")
+        result = spsolve(matrix, rhs).reshape(rhs.shape)  # a single column comes back flattened
+        if not np.isfinite(result).all():  # spsolve only warns about a singular matrix
+            raise np.linalg.LinAlgError("Singular matrix")
+        return result
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+
+'''
+Mirror symmetry about the span midline as an explicit set of design variables.
+Every node left of the midline (and every node on it) leads, its mirror image on the right follows:
+x_follower = 2 * centre - x_leader, y_follower = y_leader. Nodes on the midline keep their x.
+Only the free coordinates of the leaders are design variables, so a symmetric search moves about half
+as many numbers and can't drift out of symmetry. Nodes without a mirror image are left independent.
+
+    design = SymmetricDesign(coordinates, model.a, model.b, free=perturbation_mask(coordinates, model.a, model.b))
+    candidates = design.apply(perturb(rng, coordinates, design.mask, batch, 0.5, 0.04, 2))
+'''
+
+SYMMETRY_TOLERANCE = 1e-4  # m, the drawings are only drawn symmetric to a few 1e-5 m (cheapest.dxf)
+
+
+def mirror_pairs(coordinates, centre, tolerance=SYMMETRY_TOLERANCE):
+    """ mirror image of every node about x = centre
+    same grid spatial hash as weld_points, the nearest node within tolerance of the mirror image is picked
+
+    :param coordinates: (n_nodes, 2) array of node positions
+    :param centre: x of the midline
+    :param tolerance: how close a node has to be to the mirror image of another one
+    :return: (n_nodes,) array, index of the node at each node's mirror image, -1 if there isn't one
+    """
+    points = np.asarray(coordinates, dtype=float).tolist()
+    grid = {}  # (cell x, cell y): list of node indices
+    for i, (x, y) in enumerate(points):
+        grid.setdefault((math.floor(x / tolerance), math.floor(y / tolerance)), []).append(i)
+    mirror = np.full(len(points), -1, dtype=np.intp)
+    for i, (x, y) in enumerate(points):
+        x = 2 * centre - x
+        cell_x, cell_y = math.floor(x / tolerance), math.floor(y / tolerance)
+        nearest = tolerance
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in grid.get((cell_x + dx, cell_y + dy), ()):
+                    distance = math.hypot(points[other][0] - x, points[other][1] - y)
+                    if distance <= nearest:
+                        mirror[i], nearest = other, distance
+    return mirror
+
+
+class SymmetricDesign:
+    """ maps between the design variables of a mirror symmetric truss and its full node coordinates """
+
+    def __init__(self, coordinates, a, b, free=None, tolerance=SYMMETRY_TOLERANCE):
+        """
+        :param coordinates: (n_nodes, 2) array of node positions, decides which nodes are mirror pairs
+        :param a: index of support A
+        :param b: index of support B, the midline is halfway between A and B
+        :param free: (n_nodes, 2) bool array of the coordinates that may change,
+                     defaults to everything but the supports and the y of floor nodes
+        :param tolerance: how far from an exact mirror image still counts as one
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        n_nodes = len(coordinates)
+        self.centre = (coordinates[a, 0] + coordinates[b, 0]) / 2
+        self.mirror = mirror_pairs(coordinates, self.centre, tolerance)
+
+        if free is None:
+            free = np.ones(coordinates.shape, dtype=bool)
+            free[coordinates[:, 1] == 0, 1] = False  # floor nodes only slide along the floor
+            free[[a, b]] = False
+        self.free = np.array(free, dtype=bool)
+        on_centre = self.mirror == np.arange(n_nodes)
+        self.free[on_centre, 0] = False  # the midline node stays on the midline
+
+        paired = (self.mirror >= 0) & ~on_centre
+        self.followers = np.flatnonzero(paired & (coordinates[:, 0] > self.centre))
+        self.leaders = self.mirror[self.followers]
+        leads = np.ones(n_nodes, dtype=bool)
+        leads[self.followers] = False
+        self.mask = self.free & leads[:, None]  # the design variables
+
+    @classmethod
+    def from_model(cls, model, coordinates=None, free=None, tolerance=SYMMETRY_TOLERANCE):
+        """ SymmetricDesign over a TrussModel's node order, defaults to the geometry it was built with """
+        return cls(model.coordinates if coordinates is None else coordinates, model.a, model.b, free, tolerance)
+
+    @property
+    def symmetric(self):
+        """ whether every node has a mirror image """
+        return bool((self.mirror >= 0).all())
+
+    @property
+    def n_variables(self):
+        return int(self.mask.sum())
+
+    def variables(self, coordinates):
+        """ design variables of a geometry (or a stack of them)
+
+        :param coordinates: (..., n_nodes, 2) array of node positions
+        :return: (..., n_variables) array
+        """
+        return np.asarray(coordinates, dtype=float)[..., self.mask]
+
+    def coordinates(self, variables, base):
+        """ full node coordinates from design variables
+
+        :param variables: (..., n_variables) array
+        :param base: (n_nodes, 2) geometry the fixed coordinates are taken from
+        :return: (..., n_nodes, 2) array
+        """
+        variables = np.asarray(variables, dtype=float)
+        coordinates = np.array(np.broadcast_to(base, variables.shape[:-1] + np.shape(base)), dtype=float)
+        coordinates[..., self.mask] = variables
+        return self.apply(coordinates)
+
+    def apply(self, coordinates):
+        """ copies every leader onto its follower, the rest of the nodes are left alone
+
+        :param coordinates: (..., n_nodes, 2) array of node positions
+        :return: new (..., n_nodes, 2) array
+        """
+        coordinates = np.array(coordinates, dtype=float)
+        coordinates[..., self.followers, 0] = 2 * self.centre - coordinates[..., self.leaders, 0]
+        coordinates[..., self.followers, 1] = coordinates[..., self.leaders, 1]
+        return coordinates
+
+    def move(self, coordinates, index, position):
+        """ drags one node, its mirror image follows; only the free coordinates of the node change
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param index: node being moved
+        :param position: (x, y) where it is being moved to
+        :return: new (n_nodes, 2) array
+        """
+        coordinates = np.array(coordinates, dtype=float)
+        position = np.asarray(position, dtype=float)[:2]
+        if index in self.followers:
+            # move the leader to the mirror image instead, apply brings the follower along
+            index = self.mirror[index]
+            position = np.array([2 * self.centre - position[0], position[1]])
+        coordinates[index] = np.where(self.free[index], position, coordinates[index])
+        return self.apply(coordinates)
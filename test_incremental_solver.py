@@ -0,0 +1,21 @@
+import os
+import numpy as np
+from truss_cache import load_truss
+from truss_model import TrussModel
+from incremental_solver import IncrementalSolver
+
+DRAWING = os.path.join(os.path.dirname(__file__), 'cheapest.dxf')
+
+
+def test_dragging_one_node_updates_instead_of_refactorizing():
+    lines, (A, B), node_keys, _ = load_truss(DRAWING, cache_dir=None)
+    model = TrussModel(lines, A, B, node_keys)
+    solver = IncrementalSolver(model)
+    node = int(np.argmax(np.bincount(np.concatenate((model.start, model.end)))))  # meets the most members
+
+    for step in range(1, 6):
+        coordinates = model.coordinates.copy()
+        coordinates[node, 0] += 0.02 * step  # along the deck, floor nodes stay on it
+        np.testing.assert_allclose(solver.solve(coordinates), model.solve(coordinates), atol=1e-8)
+    assert solver.updates == 5
+    assert solver.refactorizations == 1  # only the base geometry
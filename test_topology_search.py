@@ -0,0 +1,19 @@
+import pytest
+from rigidity import check_topology
+from topology_search import build, k_truss, pratt, prune_reason
+
+
+def members(lines):
+    return {frozenset((tuple(line.start), tuple(line.end))) for line in lines}
+
+
+@pytest.mark.parametrize('panels', [4, 5, 6])
+def test_k_truss_is_not_a_pratt_truss(panels):
+    assert members(k_truss(panels)[0]) != members(pratt(panels)[0])
+
+
+@pytest.mark.parametrize('panels', [4, 5, 6])
+def test_k_truss_can_be_optimized(panels):
+    model, coordinates = build('k-truss', panels, 3.5)
+    assert check_topology(model).ok and model.determinate
+    assert prune_reason(model, coordinates) is None
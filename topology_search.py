@@ -0,0 +1,240 @@
+import argparse
+import contextlib
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from vector import Vector
+from DXFextractor import Member, get_nodes_from_lines, save_file
+from truss_model import TrussModel, node_array
+from stiffness import StiffnessModel
+from rigidity import check_topology, check_geometry, INDETERMINATE
+from constraints import FLOOR_BEAMS
+from evaluate_designs import rank, write_rows
+import global_optimizer
+from symmetry import SYMMETRY_TOLERANCE
+
+'''
+Picks the truss layout as well as the node positions. Every family below is drawn for the span with each
+of the panel counts and starting heights asked for; layouts that can't work whatever the node positions
+(mechanisms, indeterminate without the stiffness engine, degenerate joints, too few floor beams for the
+3.5 m rule) are pruned, the rest are geometry optimized with global_optimizer in a process pool and the
+table is ranked by cost (calculate_cost / is_valid from Optimizer.py, through TrussModel.evaluate_batch).
+The deck is the bottom chord, A is the left end of it and B the right end.
+
+python topology_search.py --panels 4 5 6 --seconds 20 --output topologies.csv --save-dir designs
+'''
+
+SPAN = 12
+HEIGHTS = (2.5, 3.5, 5.0)
+FIELDS = ['family', 'panels', 'height', 'nodes', 'members', 'pruned', 'start_cost', 'cost', 'valid', 'reason',
+          'evaluations', 'seconds', 'design', 'error']
+
+
+def _chords(panels, span, height):
+    """ bottom (deck) nodes 0 ... panels, top nodes 1 ... panels - 1 above them, both chords and the end posts """
+    width = span / panels
+    bottom = {i: (i * width, 0.0) for i in range(panels + 1)}
+    top = {i: (i * width, height) for i in range(1, panels)}
+    pairs = [(bottom[i], bottom[i + 1]) for i in range(panels)]
+    pairs += [(top[i], top[i + 1]) for i in range(1, panels - 1)]
+    pairs += [(bottom[0], top[1]), (bottom[panels], top[panels - 1])]
+    return bottom, top, pairs
+
+
+def pratt(panels, span=SPAN, height=3.5):
+    """ verticals, diagonals slope down towards the midspan (tension under the deck load)
+
+    :return: list of Members, A, B
+    """
+    bottom, top, pairs = _chords(panels, span, height)
+    pairs += [(bottom[i], top[i]) for i in range(1, panels)]
+    pairs += [(top[i], bottom[i + 1]) if 2 * i + 1 < panels else (top[i + 1], bottom[i]) for i in range(1, panels - 1)]
+    return [Member(pair) for pair in pairs], Vector(*bottom[0]), Vector(*bottom[panels])
+
+
+def howe(panels, span=SPAN, height=3.5):
+    """ verticals, diagonals slope up towards the midspan (compression under the deck load)
+
+    :return: list of Members, A, B
+    """
+    bottom, top, pairs = _chords(panels, span, height)
+    pairs += [(bottom[i], top[i]) for i in range(1, panels)]
+    pairs += [(bottom[i], top[i + 1]) if 2 * i + 1 < panels else (bottom[i + 1], top[i]) for i in range(1, panels - 1)]
+    return [Member(pair) for pair in pairs], Vector(*bottom[0]), Vector(*bottom[panels])
+
+
+def warren(panels, span=SPAN, height=3.5):
+    """ no verticals, the top nodes sit over the middle of each panel
+
+    :return: list of Members, A, B
+    """
+    width = span / panels
+    bottom = [(i * width, 0.0) for i in range(panels + 1)]
+    top = [((i + 0.5) * width, height) for i in range(panels)]
+    pairs = [(bottom[i], bottom[i + 1]) for i in range(panels)]
+    pairs += [(top[i], top[i + 1]) for i in range(panels - 1)]
+    pairs += [(bottom[i], top[i]) for i in range(panels)] + [(top[i], bottom[i + 1]) for i in range(panels)]
+    return [Member(pair) for pair in pairs], Vector(*bottom[0]), Vector(*bottom[panels])
+
+
+def k_truss(panels, span=SPAN, height=3.5):
+    """ the interior verticals are split at mid height and each panel gets a K, two diagonals from that
+    node to the top and bottom of the vertical nearer the support. The verticals next to the end posts
+    (and the one at midspan) aren't split, the panels at the middle get a single Pratt diagonal, which
+    keeps it determinate for every panel count. With 4 panels that would leave nothing split, so the
+    verticals next to the end posts are split instead and both Ks point in to the midspan vertical
+
+    :return: list of Members, A, B
+    """
+    bottom, top, pairs = _chords(panels, span, height)
+    width = span / panels
+    if panels == 4:
+        middle = {i: (i * width, height / 2) for i in (1, 3)}
+        pairs += [(bottom[1], middle[1]), (middle[1], top[1]), (bottom[2], top[2]), (bottom[3], middle[3]),
+                  (middle[3], top[3])]
+        pairs += [(middle[i], end) for i in (1, 3) for end in (top[2], bottom[2])]
+        return [Member(pair) for pair in pairs], Vector(*bottom[0]), Vector(*bottom[panels])
+    middle = {i: (i * width, height / 2) for i in range(2, panels - 1) if 2 * i != panels}
+    for i in range(1, panels):
+        pairs += [(bottom[i], middle[i]), (middle[i], top[i])] if i in middle else [(bottom[i], top[i])]
+    for i in range(1, panels - 1):  # panel between verticals i and i + 1
+        if i + 1 in middle and 2 * (i + 1) <= panels:
+            pairs += [(middle[i + 1], top[i]), (middle[i + 1], bottom[i])]
+        elif i in middle and 2 * i >= panels:
+            pairs += [(middle[i], top[i + 1]), (middle[i], bottom[i + 1])]
+        else:
+            pairs.append((top[i], bottom[i + 1]) if 2 * i + 1 < panels else (top[i + 1], bottom[i]))
+    return [Member(pair) for pair in pairs], Vector(*bottom[0]), Vector(*bottom[panels])
+
+
+FAMILIES = {'pratt': pratt, 'howe': howe, 'warren': warren, 'k-truss': k_truss}
+
+
+def build(family, panels, height, span=SPAN, engine=TrussModel):
+    """ draws one layout and compiles it
+
+    :return: model, (n_nodes, 2) starting coordinates
+    """
+    lines, A, B = FAMILIES[family](panels, span, height)
+    node_keys = list(get_nodes_from_lines(lines).keys())
+    node_keys.sort(key=lambda e: e[0])
+    return engine(lines, A, B, node_keys), node_array(node_keys)
+
+
+def prune_reason(model, coordinates, span=SPAN, max_floor_beam=3.5):
+    """ why no node positions can make this layout work, None if it is worth optimizing
+
+    :param model: TrussModel (or StiffnessModel)
+    :param coordinates: (n_nodes, 2) starting node positions
+    :return: reason or None
+    """
+    check = check_topology(model)
+    if not check.ok:
+        return check.reason
+    if check.reason == INDETERMINATE and not isinstance(model, StiffnessModel):
+        return check.reason  # method of joints can't solve it, --stiffness can
+    check = check_geometry(model, coordinates)
+    if not check.ok:
+        return check.reason
+    floor_beams = np.count_nonzero(coordinates[:, 1] == 0) - 1
+    if floor_beams * max_floor_beam < span:  # sliding the floor nodes can't get every beam short enough
+        return FLOOR_BEAMS
+    return None
+
+
+def enumerate_layouts(panels, heights=HEIGHTS, families=tuple(FAMILIES)):
+    """ every (family, panel count, height) combination """
+    return list(itertools.product(families, panels, heights))
+
+
+def search_layout(family, panels, height, engine=TrussModel, method='cma-es', evaluations=None, seconds=None,
+                  seed=None, symmetric=False, save_dir=None, min_force=-9, max_force=6,
+                  symmetry_tolerance=SYMMETRY_TOLERANCE):
+    """ prunes or geometry optimizes one layout, never raises
+
+    :param save_dir: directory to write the optimized design to, None to not save it
+    :return: dict with the FIELDS keys
+    """
+    row = dict.fromkeys(FIELDS)
+    row.update(family=family, panels=panels, height=height, pruned=False, valid=False)
+    with contextlib.redirect_stdout(sys.stderr):  # bad system messages would end up in the csv
+        try:
+            start = time.perf_counter()
+            model, coordinates = build(family, panels, height, engine=engine)
+            row['nodes'], row['members'] = model.n_nodes, model.n_members
+            row['reason'] = prune_reason(model, coordinates)
+            if row['reason'] is not None:
+                row['pruned'] = True
+                return row
+
+            _, costs, valid = model.evaluate_batch(coordinates[None], min_force, max_force)
+            row['start_cost'] = float(costs[0]) if valid[0] else None
+            best, cost, stats = global_optimizer.optimize(model, coordinates, method, evaluations, seconds, seed,
+                                                          symmetric, min_force, max_force, symmetry_tolerance)
+            row['evaluations'] = stats['evaluations']
+            row['seconds'] = time.perf_counter() - start
+            if best is None:
+                row['reason'] = "No valid design found"
+                return row
+            row['cost'], row['valid'] = float(cost), True
+            if save_dir is not None:
+                row['design'] = os.path.join(save_dir, f"{family}-{panels}p-{height:g}m.dxf")
+                save_file(model.lines(best), Vector(*best[model.a].tolist()), Vector(*best[model.b].tolist()),
+                          row['design'])
+        except Exception as error:  # one layout that breaks is a row in the table, not the end of the run
+            row['error'] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def _search(arguments):
+    layout, options = arguments
+    return search_layout(*layout, **options)
+
+
+def search(layouts, processes=None, **options):
+    """ search_layout over a process pool, results in the same order as layouts
+
+    :param layouts: list of (family, panels, height)
+    :param processes: pool size, defaults to the number of cores, 1 runs in this process
+    :param options: passed on to search_layout
+    :return: list of row dicts
+    """
+    jobs = [(layout, options) for layout in layouts]
+    if processes == 1 or len(jobs) <= 1:
+        return [_search(job) for job in jobs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_search, jobs, chunksize=1)  # layouts take very different times, hand them out one by one
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="optimize every parametric truss layout and rank them by cost")
+    parser.add_argument('--panels', type=int, nargs='+', default=[4, 5, 6])
+    parser.add_argument('--heights', type=float, nargs='+', default=list(HEIGHTS), help="starting heights")
+    parser.add_argument('--families', nargs='+', choices=sorted(FAMILIES), default=list(FAMILIES))
+    parser.add_argument('--method', choices=sorted(global_optimizer.METHODS), default='cma-es')
+    parser.add_argument('--evaluations', type=int, default=None, help="candidate budget per layout")
+    parser.add_argument('--seconds', type=float, default=None, help="wall clock budget per layout")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--symmetric', action='store_true', help="mirror the left half about the midline")
+    parser.add_argument('--symmetry-tolerance', type=float, default=SYMMETRY_TOLERANCE,
+                        help="m, how far from an exact mirror image still counts as one")
+    parser.add_argument('--stiffness', action='store_true', help="use the direct stiffness engine (indeterminate trusses)")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--save-dir', default=None, help="directory to write each optimized design to")
+    parser.add_argument('--output', default=None, help=".csv or .json file, prints csv if not given")
+    args = parser.parse_args()
+
+    if args.save_dir is not None:
+        os.makedirs(args.save_dir, exist_ok=True)
+    start = time.perf_counter()
+    layouts = enumerate_layouts(args.panels, args.heights, args.families)
+    rows = rank(search(layouts, args.processes,
+                       engine=StiffnessModel if args.stiffness else TrussModel, method=args.method,
+                       evaluations=args.evaluations, seconds=args.seconds, seed=args.seed,
+                       symmetric=args.symmetric, symmetry_tolerance=args.symmetry_tolerance, save_dir=args.save_dir))
+    write_rows(rows, args.output, FIELDS)
+    print(f"{len(rows)} layouts, {sum(row['pruned'] for row in rows)} pruned, {sum(row['valid'] for row in rows)} valid, "
+          f"{time.perf_counter() - start:.2f} s", file=sys.stderr)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import numpy as np
+from vector import Vector
+from DXFextractor import Member, extract_from_file, get_nodes_from_lines, WELD_TOLERANCE
+
+'''
+Parsed truss cache, so a drawing that has been seen before is one np.load instead of a parse.
+Stores the members, anchors, the node table (sorted by x like Optimizer.py and GUI-drawer.py do) and
+the member end node indices the adjacency matrix is built from, in a .npz named after the sha1 of the
+dxf's bytes and PARSER_VERSION. Editing the drawing changes the hash, changing how drawings are read
+(dxf_stream, welding, ...) should bump PARSER_VERSION so old entries are ignored.
+
+    lines, (A, B), node_keys, adjacency_matrix = load_truss('O.DXF')
+'''
+
+PARSER_VERSION = "1"
+CACHE_DIR = ".truss_cache"
+
+
+def cache_key(file_name, tolerance=WELD_TOLERANCE):
+    """ sha1 of the file contents, the parser version and the weld tolerance
+
+    :param file_name: file name of the dxf
+    :return: hex string
+    """
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(f"{PARSER_VERSION} {tolerance!r}".encode())
+    return digest.hexdigest()
+
+
+def parse_truss(file_name, tolerance=WELD_TOLERANCE):
+    """ reads a drawing into the arrays the cache stores
+
+    :param file_name: file name of the dxf
+    :return: dict of members (m, 2, 2), anchors (k, 2), nodes (n, 2), start (m,), end (m,)
+    """
+    lines, roots = extract_from_file(file_name, tolerance)
+    node_keys = list(get_nodes_from_lines(lines).keys())
+    node_keys.sort(key=lambda e: e[0])
+    node_hash = {key: value for value, key in enumerate(node_keys)}
+    return {
+        'members': np.array([(tuple(line.start), tuple(line.end)) for line in lines], dtype=float).reshape(-1, 2, 2),
+        'anchors': np.array([tuple(root) for root in roots], dtype=float).reshape(-1, 2),
+        'nodes': np.array([tuple(key) for key in node_keys], dtype=float).reshape(-1, 2),
+        'start': np.array([node_hash[line.start] for line in lines], dtype=np.intp),
+        'end': np.array([node_hash[line.end] for line in lines], dtype=np.intp),
+    }
+
+
+def adjacency_from_arrays(n_nodes, start, end):
+    """ same matrix as get_adjacency_matrix in Optimizer.py, built from the member end node indices """
+    matrix = np.zeros((n_nodes, n_nodes))
+    matrix[start, end] = 1
+    matrix[end, start] = 1
+    return matrix
+
+
+def load_arrays(file_name, cache_dir=CACHE_DIR, tolerance=WELD_TOLERANCE):
+    """ parse_truss through the cache, a stale or unreadable entry is just parsed again
+
+    :param file_name: file name of the dxf
+    :param cache_dir: directory the .npz files go in, None to skip the cache
+    :return: dict like parse_truss
+    """
+    if cache_dir is None:
+        return parse_truss(file_name, tolerance)
+    path = os.path.join(cache_dir, cache_key(file_name, tolerance) + ".npz")
+    try:
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    arrays = parse_truss(file_name, tolerance)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary = path + f".{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary, path)  # another process reading the same drawing never sees half a file
+    except OSError:
+        pass  # read only directory or similar, still works, just not cached
+    return arrays
+
+
+def load_truss(file_name, cache_dir=CACHE_DIR, tolerance=WELD_TOLERANCE):
+    """ extract_from_file + the node table and adjacency matrix, from the cache when the drawing hasn't changed
+
+    :param file_name: file name of the dxf
+    :param cache_dir: directory the .npz files go in, None to skip the cache
+    :param tolerance: weld tolerance passed to extract_from_file
+    :return: list of Members, list of anchor Vectors, list of node Vectors sorted by x, adjacency matrix
+    """
+    arrays = load_arrays(file_name, cache_dir, tolerance)
+    lines = [Member(pair) for pair in arrays['members'].tolist()]
+    roots = [Vector(*anchor) for anchor in arrays['anchors'].tolist()]
+    node_keys = [Vector(*node) for node in arrays['nodes'].tolist()]
+    return lines, roots, node_keys, adjacency_from_arrays(len(node_keys), arrays['start'], arrays['end'])
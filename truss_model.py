@@ -0,0 +1,309 @@
+import numpy as np
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve, splu
+except ImportError:  # scipy is optional, everything falls back to the dense solve
+    sparse = None
+from vector import Vector
+from DXFextractor import SPARSE_THRESHOLD, Member, get_nodes_from_lines
+from rigidity import check_geometry_batch
+from constraints import Constraints, calculate_parallel_batch, calculate_cost_batch
+
+
+def node_array(node_positions):
+    """ Converts a list of node positions (Vectors or tuples) to a (n_nodes, 2) float array
+
+    :param node_positions: list of Vectors or tuples
+    :return: numpy array of node coordinates
+    """
+    return np.array([tuple(node)[:2] for node in node_positions], dtype=float)
+
+
+class TrussModel:
+    """ A truss with a fixed topology, compiled once from a list of Members
+    the incidence structure (which nodes each member joins, where the supports are) is stored as
+    integer index arrays, so a new set of node coordinates can be assembled and solved with numpy
+    scatter operations instead of rebuilding the node dictionary and Vectors on every call
+    """
+    train_dist = 2.5  # kN/m, half of 5 since one side of two
+    sparse_threshold = SPARSE_THRESHOLD  # equations, above this solve() assembles a sparse matrix instead of a dense one
+
+    def __init__(self, lines, A, B, node_positions=None):
+        """ builds the index arrays for the truss
+
+        :param lines: list of Members
+        :param A: Vector, pinned support (Ax, Ay)
+        :param B: Vector, roller support (By)
+        :param node_positions: optional list of node positions that sets the node order,
+                               defaults to the order from get_nodes_from_lines
+        """
+        if node_positions is None:
+            node_positions = list(get_nodes_from_lines(lines).keys())
+        node_positions = [Vector(*node) for node in node_positions]
+        node_hash = {key: value for value, key in enumerate(node_positions)}
+
+        self.n_nodes = len(node_positions)
+        self.n_members = len(lines)
+        self.coordinates = node_array(node_positions)  # geometry the model was built with
+        self.start = np.array([node_hash[line.start] for line in lines], dtype=np.intp)
+        self.end = np.array([node_hash[line.end] for line in lines], dtype=np.intp)
+        self.a = node_hash[A]
+        self.b = node_hash[B]
+        self.determinate = 2*self.n_nodes == self.n_members + 3
+        self.topology = (self.n_nodes, self.a, self.b, self.start.tobytes(), self.end.tobytes())  # hashable
+
+        # the same (row, column) pairs are written on every assembly, work them out once
+        # columns: F1 ... Fn, Ax, Ay, By
+        members = np.arange(self.n_members)
+        self._rows = np.concatenate((2*self.start, 2*self.start + 1, 2*self.end, 2*self.end + 1))
+        self._cols = np.concatenate((members,)*4)
+        self._reaction_rows = np.array([2*self.a, 2*self.a + 1, 2*self.b + 1])
+        self._reaction_cols = self.n_members + np.arange(3)
+
+    def print_bad_system(self):
+        print("nodes:", self.n_nodes)
+        print("lines:", self.n_members)
+        print('bad system:')
+
+    def lines(self, coordinates):
+        """ rebuilds the Members for a set of node positions, in the model's member order
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: list of Members
+        """
+        points = np.asarray(coordinates).tolist()  # plain floats so the Vectors hash like the ones from the dxf
+        return [Member((points[s], points[e])) for s, e in zip(self.start, self.end)]
+
+    def unit_vectors(self, coordinates):
+        """ direction of every member from its end node to its start node
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: (n_members, 2) array of unit vectors, (n_members,) array of lengths
+        """
+        delta = coordinates[self.start] - coordinates[self.end]
+        lengths = np.hypot(delta[:, 0], delta[:, 1])
+        return delta / lengths[:, None], lengths
+
+    def coefficient_matrix(self, coordinates):
+        """ fills the method of joints coefficient matrix for the given node positions
+        same layout as solve_truss, all members assumed to be in compression (pushing into the node)
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: (2*n_nodes, n_members + 3) array
+        """
+        unit, _ = self.unit_vectors(coordinates)
+        matrix = np.zeros((2*self.n_nodes, self.n_members + 3))
+        # the start node sees the member pushing along +unit, the end node along -unit
+        matrix[self._rows, self._cols] = np.concatenate((unit[:, 0], unit[:, 1], -unit[:, 0], -unit[:, 1]))
+        matrix[self._reaction_rows, self._reaction_cols] = 1  # Ax left, Ay up, By up
+        return matrix
+
+    def coefficient_matrix_sparse(self, coordinates):
+        """ coefficient_matrix in compressed sparse column form, each column only has the 4 entries of a
+        member (or the 1 of a reaction) so this is O(n) memory instead of O(n^2)
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: scipy.sparse csc matrix, (2*n_nodes, n_members + 3)
+        """
+        unit, _ = self.unit_vectors(coordinates)
+        values = np.concatenate((unit[:, 0], unit[:, 1], -unit[:, 0], -unit[:, 1], np.ones(3)))
+        rows = np.concatenate((self._rows, self._reaction_rows))
+        cols = np.concatenate((self._cols, self._reaction_cols))
+        return sparse.csc_matrix((values, (rows, cols)), shape=(2*self.n_nodes, self.n_members + 3))
+
+    def constant_matrix(self, coordinates):
+        """ distributes the train load onto the floor (y=0) nodes
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :return: (2*n_nodes,) array, y rows hold the load at each floor node
+        """
+        floor = np.flatnonzero(coordinates[:, 1] == 0)
+        floor = floor[np.argsort(coordinates[floor, 0], kind='stable')]
+        span = np.diff(coordinates[floor], axis=0)
+        force = self.train_dist * np.hypot(span[:, 0], span[:, 1]) / 2
+
+        # each floor segment puts half of its load on the node at either end
+        constant = np.zeros(2*self.n_nodes)
+        constant[1::2] = np.bincount(floor[:-1], force, self.n_nodes) + np.bincount(floor[1:], force, self.n_nodes)
+        return constant
+
+    def solve(self, coordinates=None):
+        """ solves the truss for a new set of node positions, topology is unchanged
+
+        :param coordinates: (n_nodes, 2) array in the same node order as the model,
+                            defaults to the geometry the model was built with
+        :return: F1, F2, F3, F4, ..., Ax, Ay, By or None if the system is not determinate
+        """
+        if not self.determinate:
+            self.print_bad_system()
+            return None
+        if coordinates is None:
+            coordinates = self.coordinates
+        if sparse is not None and 2*self.n_nodes > self.sparse_threshold:
+            forces = spsolve(self.coefficient_matrix_sparse(coordinates), self.constant_matrix(coordinates))
+            if not np.isfinite(forces).all():  # spsolve only warns about a singular matrix
+                raise np.linalg.LinAlgError("Singular matrix")
+            return forces
+        return np.linalg.solve(self.coefficient_matrix(coordinates), self.constant_matrix(coordinates))
+
+    def solve_many(self, coordinates, constants):
+        """ solves one geometry for many load cases, the matrix is only factorized once
+
+        :param coordinates: (n_nodes, 2) array of node positions
+        :param constants: (2*n_nodes, cases) array, one constant_matrix per column
+        :return: (n_members + 3, cases) array or None if the system is not determinate
+        """
+        if not self.determinate:
+            self.print_bad_system()
+            return None
+        if sparse is not None and 2*self.n_nodes > self.sparse_threshold:
+            try:
+                return splu(self.coefficient_matrix_sparse(coordinates)).solve(np.asarray(constants, dtype=float))
+            except RuntimeError:  # splu: "Factor is exactly singular"
+                raise np.linalg.LinAlgError("Singular matrix")
+        return np.linalg.solve(self.coefficient_matrix(coordinates), constants)
+
+    def solve_batch(self, coordinates):
+        """ solves many candidate geometries of this topology with one stacked np.linalg.solve
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: (batch, n_members + 3) array of F1, ..., Ax, Ay, By, rows are nan where the
+                 candidate's matrix is singular, None if the system is not determinate
+        """
+        if not self.determinate:
+            self.print_bad_system()
+            return None
+        coordinates = np.asarray(coordinates, dtype=float)
+        matrices = self.coefficient_matrix_batch(coordinates)
+        constants = self.constant_matrix_batch(coordinates)[..., None]  # column vectors for the stacked solve
+
+        # degenerate layouts are caught up front and get an identity matrix so they can't break the stack
+        degenerate = ~check_geometry_batch(self, coordinates)
+        matrices[degenerate] = np.eye(2*self.n_nodes)
+        try:
+            forces = np.linalg.solve(matrices, constants)[..., 0]
+            forces[degenerate] = np.nan
+            return forces
+        except np.linalg.LinAlgError:
+            # one bad candidate fails the whole stack, redo them one by one and blank the singular ones
+            forces = np.full((len(coordinates), self.n_members + 3), np.nan)
+            for i in np.flatnonzero(~degenerate):
+                try:
+                    forces[i] = np.linalg.solve(matrices[i], constants[i])[:, 0]
+                except np.linalg.LinAlgError:
+                    pass
+            return forces
+
+    def coefficient_matrix_batch(self, coordinates):
+        """ coefficient_matrix for a stack of geometries
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: (batch, 2*n_nodes, n_members + 3) array
+        """
+        unit, _ = self.unit_vectors_batch(coordinates)
+        matrices = np.zeros((len(coordinates), 2*self.n_nodes, self.n_members + 3))
+        matrices[:, self._rows, self._cols] = np.concatenate(
+            (unit[..., 0], unit[..., 1], -unit[..., 0], -unit[..., 1]), axis=1)
+        matrices[:, self._reaction_rows, self._reaction_cols] = 1
+        return matrices
+
+    def constant_matrix_batch(self, coordinates):
+        """ constant_matrix for a stack of geometries, the floor nodes may differ between candidates
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: (batch, 2*n_nodes) array
+        """
+        batch = len(coordinates)
+        # push the non floor nodes to the end of each row, then only pair up neighbouring floor nodes
+        floor_x = np.where(coordinates[..., 1] == 0, coordinates[..., 0], np.inf)
+        order = np.argsort(floor_x, axis=1, kind='stable')
+        sorted_x = np.take_along_axis(floor_x, order, axis=1)
+        beams = np.diff(np.where(np.isfinite(sorted_x), sorted_x, 0), axis=1)
+        force = np.where(np.isfinite(sorted_x[:, 1:]), self.train_dist * beams / 2, 0)
+
+        offset = self.n_nodes * np.arange(batch)[:, None]  # flatten (candidate, node) for a single bincount
+        loads = np.bincount((order[:, :-1] + offset).ravel(), force.ravel(), batch*self.n_nodes)
+        loads += np.bincount((order[:, 1:] + offset).ravel(), force.ravel(), batch*self.n_nodes)
+
+        constants = np.zeros((batch, 2*self.n_nodes))
+        constants[:, 1::2] = loads.reshape(batch, self.n_nodes)
+        return constants
+
+    def evaluate_batch(self, coordinates, min_force=-9, max_force=6, decimals=4):
+        """ solves a stack of candidate geometries and scores them the same way as
+        calculate_cost and is_valid in Optimizer.py
+        candidates that break a geometric rule are rejected before the solve
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :param min_force: tension limit of one member (negative)
+        :param max_force: compression limit of one member
+        :param decimals: forces are rounded like the optimizer does before scoring
+        :return: forces (batch, n_members + 3), costs (batch,), valid (batch,) bool
+                 forces are nan and costs inf for candidates that were rejected early or couldn't be solved
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        _, lengths = self.unit_vectors_batch(coordinates)
+        forces = self.forces_batch(coordinates, decimals, lengths)
+        if forces is None:
+            return None
+        costs, valid = self.score_batch(coordinates, forces, min_force, max_force, lengths)
+        return forces, costs, valid
+
+    def forces_batch(self, coordinates, decimals=4, lengths=None):
+        """ the solving half of evaluate_batch, the forces don't depend on the force limits
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :param decimals: forces are rounded like the optimizer does before scoring
+        :param lengths: (batch, n_members) member lengths if they are already worked out
+        :return: (batch, n_members + 3) array, nan for candidates that were rejected early or couldn't be
+                 solved, None if the system is not determinate
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        geometric = Constraints.for_model(self).valid_batch(coordinates, lengths=lengths)
+        forces = np.full((len(coordinates), self.n_members + 3), np.nan)
+        solved_forces = self.solve_batch(coordinates[geometric])
+        if solved_forces is None:
+            return None
+        forces[geometric] = np.round(solved_forces, decimals=decimals)
+        return forces
+
+    def score_batch(self, coordinates, forces, min_force=-9, max_force=6, lengths=None):
+        """ the scoring half of evaluate_batch
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :param forces: (batch, n_members + 3) array from forces_batch
+        :param lengths: (batch, n_members) member lengths if they are already worked out
+        :return: costs (batch,), valid (batch,) bool, inf and False where forces are nan
+        """
+        if lengths is None:
+            _, lengths = self.unit_vectors_batch(np.asarray(coordinates, dtype=float))
+        member_forces = forces[:, :self.n_members]
+        solved = ~np.isnan(member_forces).any(axis=1)
+        member_forces = np.where(np.isnan(member_forces), 0, member_forces)
+
+        parallel = calculate_parallel_batch(member_forces, min_force, max_force)
+        costs = calculate_cost_batch(self.n_nodes, lengths, parallel)
+
+        constraints = Constraints.for_model(self, min_force=min_force, max_force=max_force)
+        valid = solved & ~constraints.force_batch(forces)
+        return np.where(solved, costs, np.inf), valid
+
+    def unit_vectors_batch(self, coordinates):
+        """ unit_vectors for a stack of geometries
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :return: (batch, n_members, 2) unit vectors, (batch, n_members) lengths
+        """
+        delta = coordinates[:, self.start] - coordinates[:, self.end]
+        lengths = np.hypot(delta[..., 0], delta[..., 1])
+        with np.errstate(invalid='ignore', divide='ignore'):  # zero length members, solve_batch blanks those
+            return delta / lengths[..., None], lengths
+
+    def geometry_valid_batch(self, coordinates, lengths=None):
+        """ the rules from is_valid that don't need the forces, see constraints.Constraints
+
+        :param coordinates: (batch, n_nodes, 2) array of node positions
+        :param lengths: (batch, n_members) member lengths if they are already worked out
+        :return: (batch,) bool array
+        """
+        return Constraints.for_model(self).valid_batch(coordinates, lengths=lengths)
@@ -0,0 +1,223 @@
+import numpy as np
+import pygame
+from constraints import calculate_parallel_batch
+
+'''
+Retained mode drawing for GUI-drawer.py. The truss (members, nodes, force labels and the status text) is
+drawn once onto an off screen layer and only the parts that change are drawn again:
+    - set_truss compares the new members with the ones on the layer and redraws just the regions of the
+      members whose position, stacking or label changed (all of it if most of them did)
+    - draw copies the changed regions and the nodes whose hover state changed to the screen and returns
+      the rectangles for pygame.display.update, an idle frame returns an empty list and draws nothing
+Force labels are rendered once per distinct text and kept, a drag only renders the labels it changes.
+
+    renderer = TrussRenderer(screen, font, transform_array)
+    renderer.set_truss(lines, member_forces, status)  # only when the truss or the forces changed
+    pygame.display.update(renderer.draw(mouse_pos))
+'''
+
+
+class TrussRenderer:
+    """ off screen layer of the truss, redrawn a region at a time """
+    background = (240, 240, 240)
+    member_color = (100, 100, 100)
+    node_color = (0, 0, 0)
+    hover_color = (100, 0, 0)
+    text_color = (0, 0, 0)
+    node_radius = 5  # px
+    snap_radius = 5  # px, the mouse is over a node when it is closer than this
+    stack_offset = 0.03  # m either side of the centreline for 2 and 3 stacked members
+    label_offset = (40, 10)  # px, label top left relative to the member midpoint
+    status_position = (10, 10)  # px, first status line, the rest are 20 px apart
+    max_labels = 5000  # rendered label surfaces kept
+    full_redraw = 0.25  # fraction of changed members past which the whole layer is redrawn
+    max_rects = 100  # more changed regions than this are redrawn as one rectangle around them all
+
+    def __init__(self, screen, font, to_screen, min_force=-9, max_force=6, scale=100):
+        """
+        :param screen: pygame display surface
+        :param font: pygame.freetype font for the labels and status text
+        :param to_screen: function from (n, 2) world coordinates to (n, 2) screen coordinates
+        :param min_force: tension limit of one member (negative), decides the stacking drawn
+        :param max_force: compression limit of one member
+        :param scale: px per m, for the gap between stacked members
+        """
+        self.screen = screen
+        self.font = font
+        self.to_screen = to_screen
+        self.min_force, self.max_force = min_force, max_force
+        self.scale = scale
+        self.layer = pygame.Surface(screen.get_size())
+        self.layer.fill(self.background)
+        self.scratch = pygame.Surface(screen.get_size())  # drawn on first, see _redraw
+        self.labels = {}
+        self.label_renders = 0
+        self.truss = None  # what is on the layer
+        self.status_text = []
+        self.status = []  # (surface, rect) per status line on the layer
+        self.hover = np.zeros(0, dtype=bool)
+        self._dirty = [self.layer.get_rect()]  # regions of the layer the screen hasn't been given yet
+
+    def label(self, text):
+        """ rendered text, from the cache if it has been drawn before
+
+        :return: (surface, rect) from font.render
+        """
+        rendered = self.labels.get(text)
+        if rendered is None:
+            if len(self.labels) >= self.max_labels:
+                self.labels.clear()
+            rendered = self.labels[text] = self.font.render(text, self.text_color)
+            self.label_renders += 1
+        return rendered
+
+    def set_truss(self, lines, forces, status=()):
+        """ puts a new truss on the layer, only the members that differ from the last one are redrawn
+
+        :param lines: list of Members
+        :param forces: member forces in the order of lines
+        :param status: lines of status text drawn in the top left
+        :return: None
+        """
+        truss = self._layout(lines, forces)
+        old = self.truss
+        dirty = []
+        if old is None or len(old['texts']) != len(truss['texts']):
+            dirty.append(self.layer.get_rect())
+        else:
+            changed = ((old['ends'] != truss['ends']).any(axis=(1, 2)) | (old['parallel'] != truss['parallel'])
+                       | (old['texts'] != truss['texts']))
+            if changed.sum() > self.full_redraw * len(changed):
+                dirty.append(self.layer.get_rect())
+            else:
+                for boxes in (old['bounds'], truss['bounds'], old['label_bounds'], truss['label_bounds']):
+                    dirty += [pygame.Rect(box) for box in boxes[changed].tolist()]
+
+        status = list(status)
+        if status != self.status_text:  # cost and validity only get rendered again when they change
+            x, y = self.status_position
+            rendered = [self.font.render(text, self.text_color) for text in status]
+            rendered = [(surface, pygame.Rect(x, y + 20 * i, rect.width, rect.height))
+                        for i, (surface, rect) in enumerate(rendered)]
+            dirty += [rect for _, rect in self.status] + [rect for _, rect in rendered]
+            self.status_text, self.status = status, rendered
+
+        self.truss = truss
+        if len(truss['nodes']) != len(self.hover):
+            self.hover = np.zeros(len(truss['nodes']), dtype=bool)
+        self._redraw(dirty)
+
+    def invalidate(self):
+        """ the screen was drawn over by something else, give it the whole layer on the next draw """
+        self._dirty = [self.layer.get_rect()]
+
+    def draw(self, mouse_pos):
+        """ brings the screen up to date, only touching what changed since the last draw
+
+        :param mouse_pos: (x, y) of the mouse on screen
+        :return: list of pygame.Rects that were drawn, for pygame.display.update
+        """
+        hover = self._hovered(mouse_pos)
+        rects = self._dirty
+        self._dirty = []
+        rects += [self._node_rect(node) for node in self.truss['nodes'][hover != self.hover].tolist()]
+        self.hover = hover
+        if not rects:
+            return []
+        for rect in rects:
+            self.screen.blit(self.layer, rect, rect)
+        for node in self.truss['nodes'][hover].tolist():
+            rect = self._node_rect(node)
+            if rect.collidelist(rects) >= 0:
+                pygame.draw.circle(self.screen, self.hover_color, node, self.node_radius)
+        return rects
+
+    def draw_all(self, mouse_pos):
+        """ the whole layer plus the hovered nodes, for frames where more is drawn on top (flip afterwards) """
+        self.screen.blit(self.layer, (0, 0))
+        self.hover = self._hovered(mouse_pos)
+        for node in self.truss['nodes'][self.hover].tolist():
+            pygame.draw.circle(self.screen, self.hover_color, node, self.node_radius)
+        self.invalidate()  # whatever goes on top has to be cleared off again
+
+    def _layout(self, lines, forces):
+        """ screen positions, stacking, labels and bounding boxes of every member """
+        forces = np.asarray(forces, dtype=float)
+        world = np.array([(tuple(line.start)[:2], tuple(line.end)[:2]) for line in lines], dtype=float).reshape(-1, 2, 2)
+        ends = self.to_screen(world.reshape(-1, 2)).reshape(-1, 2, 2)
+        parallel = calculate_parallel_batch(forces, self.min_force, self.max_force).astype(int)
+        texts = np.array([f"{round(float(force), 2)} kN {'(T)' if force < 0 else '(C)'}" for force in forces.tolist()],
+                         dtype=object)
+
+        margin = int(np.ceil(max(self.node_radius, self.stack_offset * self.scale))) + 2
+        corners = np.round(ends).astype(int)
+        low = corners.min(axis=1) - margin
+        high = corners.max(axis=1) + margin
+        bounds = np.column_stack((low, high - low + 1))
+
+        positions = np.round((ends[:, 0] + ends[:, 1]) / 2 - self.label_offset).astype(int)
+        label_rects = [self.label(text)[1] for text in texts.tolist()]
+        label_bounds = np.array([(x, y, rect.width, rect.height) for (x, y), rect in zip(positions.tolist(), label_rects)],
+                                dtype=int).reshape(-1, 4)
+        nodes = np.unique(corners.reshape(-1, 2), axis=0)
+        node_bounds = np.column_stack((nodes - self.node_radius - 1, np.full((len(nodes), 2), 2 * self.node_radius + 3)))
+        return {'ends': ends, 'corners': corners, 'parallel': parallel, 'texts': texts, 'bounds': bounds,
+                'positions': positions, 'label_bounds': label_bounds, 'nodes': nodes, 'node_bounds': node_bounds}
+
+    def _redraw(self, rects):
+        """ draws the regions of the layer again from the current truss
+        pygame.draw.line picks slightly different pixels for a line that is clipped, so everything touching
+        the regions is drawn unclipped on the scratch surface and only the regions are copied to the layer
+        """
+        bounds = self.layer.get_rect()
+        rects = [rect.clip(bounds) for rect in rects]
+        rects = [rect for rect in rects if rect.width and rect.height]
+        if len(rects) > self.max_rects:
+            rects = [rects[0].unionall(rects)]
+        if not rects:
+            return
+        truss = self.truss
+        members = np.zeros(len(truss['bounds']), dtype=bool)
+        nodes = np.zeros(len(truss['nodes']), dtype=bool)
+        labels = np.zeros(len(truss['label_bounds']), dtype=bool)
+        for rect in rects:
+            self.scratch.fill(self.background, rect)
+            members |= _overlaps(truss['bounds'], rect)
+            nodes |= _overlaps(truss['node_bounds'], rect)
+            labels |= _overlaps(truss['label_bounds'], rect)
+
+        for i in np.flatnonzero(members).tolist():
+            start, end = truss['ends'][i]
+            direction = end - start
+            if truss['parallel'][i] != 2:  # when equal to 1, 3 (zero force member was disappearing)
+                pygame.draw.line(self.scratch, self.member_color, start.tolist(), end.tolist(), 1)
+            if truss['parallel'][i] in (2, 3):
+                length = np.hypot(*direction)
+                offset = self.stack_offset * self.scale * np.array([-direction[1], direction[0]]) / (length or 1)
+                pygame.draw.line(self.scratch, self.member_color, (start + offset).tolist(), (end + offset).tolist(), 1)
+                pygame.draw.line(self.scratch, self.member_color, (start - offset).tolist(), (end - offset).tolist(), 1)
+        for node in truss['nodes'][nodes].tolist():
+            pygame.draw.circle(self.scratch, self.node_color, node, self.node_radius)
+        for i in np.flatnonzero(labels).tolist():
+            self.scratch.blit(self.label(truss['texts'][i])[0], truss['positions'][i].tolist())
+        for surface, status_rect in self.status:
+            if status_rect.collidelist(rects) >= 0:
+                self.scratch.blit(surface, status_rect)
+
+        for rect in rects:
+            self.layer.blit(self.scratch, rect, rect)
+        self._dirty += rects
+
+    def _hovered(self, mouse_pos):
+        nodes = self.truss['nodes']
+        return np.hypot(nodes[:, 0] - mouse_pos[0], nodes[:, 1] - mouse_pos[1]) < self.snap_radius
+
+    def _node_rect(self, node):
+        return pygame.Rect(node[0] - self.node_radius - 1, node[1] - self.node_radius - 1,
+                           2 * self.node_radius + 3, 2 * self.node_radius + 3)
+
+
+def _overlaps(boxes, rect):
+    """ which (x, y, width, height) boxes overlap a pygame.Rect """
+    return ((boxes[:, 0] < rect.right) & (boxes[:, 0] + boxes[:, 2] > rect.left)
+            & (boxes[:, 1] < rect.bottom) & (boxes[:, 1] + boxes[:, 3] > rect.top))
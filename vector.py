@@ -2,6 +2,8 @@ import math
 
 
 class Vector(object):
+    __slots__ = ('values',)  # no per instance __dict__, these get made by the thousand
+
     def __init__(self, *args):
         """ Create a vector, example: v = Vector(1,2) """
         if len(args) == 0: